@@ -0,0 +1,169 @@
+import threading
+from contextlib import contextmanager
+from mysql.connector import pooling, InterfaceError, OperationalError
+
+# Shared data access layer of all stages: one connection pool per process, every thread keeps
+# one pooled connection and a cache of prepared statements on it.
+class Database:
+    def __init__(self, config, pool_size=None, pool_name=None):
+        self.user = config.get('db-user')
+        self.password = config.get('db-password')
+        self.host = config.get('db-host')
+        self.database = config.get('db-database')
+        self.pool_size = pool_size or config.get('db-pool-size', 5)
+
+        self.pool = pooling.MySQLConnectionPool(
+            pool_name=pool_name or f"{self.database}-pool",
+            pool_size=self.pool_size,
+            pool_reset_session=False,
+            host=self.host,
+            database=self.database,
+            user=self.user,
+            password=self.password
+        )
+        self._local = threading.local()
+        print(f"Connection pool to the database was created (size: {self.pool_size}).")
+
+    # The connection of the calling thread. It is not pinged on every call, the pool checks (and
+    # reconnects) a connection when it hands it out and a lost connection is replaced on its first error.
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self.pool.get_connection()
+            self._local.statements = {}
+        return connection
+
+    # True if error means the server closed the connection (timeout, restart), only pings after an error
+    def _lost(self, connection, error):
+        return isinstance(error, (InterfaceError, OperationalError)) and not connection.is_connected()
+
+    # Drops the lost connection of the calling thread, the next call takes one from the pool
+    def _discard(self):
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        self._local.statements = {}
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def is_connected(self):
+        try:
+            return self.connection().is_connected()
+        except Exception:
+            return False
+
+    # Returns the connection of the calling thread to the pool
+    def release(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            return
+        for _, cursor in self._local.statements.values():
+            cursor.close()
+        self._local.statements = {}
+        self._local.connection = None
+        connection.close()
+
+    def _statement(self, query):
+        connection = self.connection()
+        statement = self._local.statements.get(query)
+        if statement is None:
+            # The prepared cursor only re-prepares if it gets a different query object
+            statement = self._local.statements[query] = (query, connection.cursor(prepared=True))
+        return (connection, *statement)
+
+    # Runs a prepared statement, once more on a fresh connection if the connection of the thread was lost.
+    # Statements of execute() are committed on their own, a lost one was never committed.
+    def _run(self, query, params, commit):
+        for attempt in range(2):
+            connection, query_object, cursor = self._statement(query)
+            try:
+                cursor.execute(query_object, params)
+                if commit:
+                    connection.commit()
+                    return cursor.rowcount
+                return cursor.fetchall()
+            except Exception as e:
+                if self._lost(connection, e):
+                    self._discard()
+                    if attempt == 0:
+                        continue
+                elif commit:
+                    connection.rollback()
+                raise
+
+    # Plain cursor inside a transaction: committed on success, rolled back on errors
+    @contextmanager
+    def transaction(self):
+        connection = self.connection()
+        cursor = connection.cursor()
+        try:
+            yield cursor
+            connection.commit()
+        except Exception as e:
+            if self._lost(connection, e):
+                self._discard()
+            else:
+                connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    # Single statement with a fixed number of parameters, executed as prepared statement
+    def execute(self, query, params=()):
+        return self._run(query, params, commit=True)
+
+    # Writes all rows with executemany in batches of batch_size and one commit
+    def execute_many(self, query, rows, batch_size=1000):
+        rows = list(rows)
+        rowcount = 0
+        with self.transaction() as cursor:
+            for offset in range(0, len(rows), batch_size):
+                cursor.executemany(query, rows[offset:offset + batch_size])
+                rowcount += max(cursor.rowcount, 0)
+        return rowcount
+
+    def fetch_one(self, query, params=()):
+        rows = self._run(query, params, commit=False)
+        return rows[0] if rows else None
+
+    def fetch_all(self, query, params=()):
+        return self._run(query, params, commit=False)
+
+    # Rows plus column names, for building DataFrames
+    def fetch_all_with_columns(self, query, params=()):
+        with self.transaction() as cursor:
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            return rows, [column[0] for column in cursor.description]
+
+    # Streams the result in chunks of chunk_size rows, yields (rows, column names).
+    # Unbuffered cursor on a connection of its own, rows are only transferred as they are fetched.
+    def iter_chunks(self, query, params=(), chunk_size=1000):
+        connection = self.pool.get_connection()
+        cursor = connection.cursor(buffered=False)
+        try:
+            cursor.execute(query, params)
+            column_names = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows, column_names
+        finally:
+            # The caller may stop early, the rest of the result has to be read before the connection is reused
+            connection.consume_results()
+            cursor.close()
+            connection.close()
+
+    # Runs query once per batch of ids, query contains {ids} where the placeholders of the batch go
+    def fetch_by_ids(self, query, ids, batch_size=1000):
+        ids = list(ids)
+        rows = []
+        with self.transaction() as cursor:
+            for offset in range(0, len(ids), batch_size):
+                batch = ids[offset:offset + batch_size]
+                cursor.execute(query.format(ids=', '.join(['%s'] * len(batch))), tuple(batch))
+                rows.extend(cursor.fetchall())
+        return rows
@@ -0,0 +1,94 @@
+# Output table of every pipeline stage -> the table the stage reads from
+STAGE_SOURCES = {
+    'tickets_texts': 'tickets',                         # ticket-prep/cleanup-tickets.py
+    'tickets_texts_cleaned': 'tickets_texts',           # ticket-presidio/clean-pii.py
+    'tickets_summary': 'tickets_texts_cleaned'          # ticket-prep/sum-tickets.py
+}
+
+# A ticket is pending for a stage if it exists in the source table and is either missing in the
+# stage table (anti-join) or marked stale for the stage by get-tickets.py (--delta/--recheck),
+# unless the stage flagged it in tickets_flagged.
+# Keyset paging (id below the last id of the previous chunk) keeps every chunk an index range scan,
+# rows written by the stage in the meantime do not shift the following chunks.
+PENDING_IDS = """
+    SELECT source.id FROM {source} source
+    LEFT JOIN {stage} target ON target.id = source.id
+    WHERE target.id IS NULL AND source.id < %s
+    UNION
+    SELECT source.id FROM tickets_stale stale
+    JOIN {source} source ON source.id = stale.id
+    WHERE stale.stage = %s AND stale.id < %s
+"""
+
+NOT_FLAGGED = " WHERE id NOT IN (SELECT id FROM tickets_flagged WHERE stage = %s)"
+
+PENDING_IDS_QUERY = "SELECT id FROM (" + PENDING_IDS + ") pending" + NOT_FLAGGED + " ORDER BY id DESC LIMIT %s;"
+PENDING_COUNT_QUERY = "SELECT COUNT(*) FROM (" + PENDING_IDS + ") pending" + NOT_FLAGGED + ";"
+
+# Run by a stage in the transaction that rewrites the row of a ticket
+CLEAR_STALE_QUERY = "DELETE FROM tickets_stale WHERE id = %s AND stage = %s;"
+
+# Tickets a stage cannot process are flagged with a reason instead of blocking every run
+FLAG_QUERY = """
+    INSERT INTO tickets_flagged (id, stage, reason) VALUES (%s, %s, %s)
+    ON DUPLICATE KEY UPDATE reason = VALUES(reason), flagged_at = CURRENT_TIMESTAMP;
+"""
+
+# Marks the row of a ticket in a stage table stale, if the stage already has one
+MARK_STALE_QUERY = "INSERT IGNORE INTO tickets_stale (id, stage) SELECT id, %s FROM {stage} WHERE id = %s;"
+
+TICKET_IDS_QUERY = "SELECT id FROM {table} WHERE id < %s ORDER BY id DESC LIMIT %s;"
+
+# Values the scripts keep between runs, e.g. the last delta sync of get-tickets.py
+READ_STATE_QUERY = "SELECT value FROM pipeline_state WHERE name = %s;"
+UPDATE_STATE_QUERY = "INSERT INTO pipeline_state (name, value) VALUES (%s, %s) ON DUPLICATE KEY UPDATE value = VALUES(value);"
+
+# Larger than any ticket id, start of the keyset paging
+MAX_TICKET_ID = 2 ** 31
+
+def _iter_chunks(database, query, params, chunk_size):
+    last_id = MAX_TICKET_ID
+    while True:
+        ticket_ids = [row[0] for row in database.fetch_all(query, params(last_id))]
+        if not ticket_ids:
+            return
+        yield ticket_ids
+        if len(ticket_ids) < chunk_size:
+            return
+        last_id = ticket_ids[-1]
+
+# Yields the pending ticket ids of a stage in chunks of up to chunk_size ids, highest id first
+def iter_pending_ids(database, stage, chunk_size=500):
+    query = PENDING_IDS_QUERY.format(source=STAGE_SOURCES[stage], stage=stage)
+    return _iter_chunks(database, query, lambda last_id: (last_id, stage, last_id, stage, chunk_size), chunk_size)
+
+# Yields all ticket ids of a table in chunks of up to chunk_size ids, highest id first
+def iter_ticket_ids(database, table, chunk_size=500):
+    query = TICKET_IDS_QUERY.format(table=table)
+    return _iter_chunks(database, query, lambda last_id: (last_id, chunk_size), chunk_size)
+
+# Stages that (directly or indirectly) read from the table of a stage, in pipeline order
+def downstream_stages(stage):
+    stages = []
+    for target, source in STAGE_SOURCES.items():
+        if source == stage:
+            stages.append(target)
+            stages.extend(downstream_stages(target))
+    return stages
+
+# Marks the rows of the downstream stages of a stage stale for tickets whose row in the stage changed,
+# runs on the cursor of the transaction that wrote the rows
+def mark_downstream_stale(cursor, stage, ticket_ids):
+    for downstream in downstream_stages(stage):
+        cursor.executemany(MARK_STALE_QUERY.format(stage=downstream), [(downstream, ticket_id) for ticket_id in ticket_ids])
+
+def read_state(database, name):
+    row = database.fetch_one(READ_STATE_QUERY, (name,))
+    return row[0] if row else None
+
+def update_state(database, name, value):
+    database.execute(UPDATE_STATE_QUERY, (name, value))
+
+def count_pending_ids(database, stage):
+    query = PENDING_COUNT_QUERY.format(source=STAGE_SOURCES[stage], stage=stage)
+    return database.fetch_one(query, (MAX_TICKET_ID, stage, MAX_TICKET_ID, stage))[0]
@@ -0,0 +1,49 @@
+from collections import Counter
+
+PERCENTILES = (50, 90, 99)
+
+class TextStats:
+    # Statistics of text columns collected chunk by chunk: row count, NULL and empty rates and
+    # length percentiles. Lengths are kept as a histogram, so memory depends on the number of
+    # distinct lengths and not on the number of rows.
+    def __init__(self, columns):
+        self.columns = columns
+        self.rows = 0
+        self.nulls = Counter()
+        self.empties = Counter()
+        self.lengths = {column: Counter() for column in columns}
+
+    def add(self, df):
+        self.rows += len(df)
+        for column in self.columns:
+            values = df[column]
+            self.nulls[column] += int(values.isna().sum())
+            texts = values.dropna().astype(str)
+            self.empties[column] += int((texts.str.strip() == '').sum())
+            self.lengths[column].update(texts.str.len().value_counts().to_dict())
+
+    def percentile(self, column, percent):
+        lengths = self.lengths[column]
+        total = sum(lengths.values())
+        if not total:
+            return None
+        rank = max(1, -(-total * percent // 100))
+        seen = 0
+        for length in sorted(lengths):
+            seen += lengths[length]
+            if seen >= rank:
+                return length
+
+    def _rate(self, count):
+        return 100 * count / self.rows if self.rows else 0.0
+
+    def report(self):
+        print(f"Rows: {self.rows}")
+        for column in self.columns:
+            nulls = self.nulls[column]
+            empties = self.empties[column]
+            lengths = self.lengths[column]
+            print(f"Column {column}: NULL {nulls} ({self._rate(nulls):.1f}%), empty {empties} ({self._rate(empties):.1f}%)")
+            if lengths:
+                percentiles = ', '.join(f"p{percent} {self.percentile(column, percent)}" for percent in PERCENTILES)
+                print(f"Column {column} length: min {min(lengths)}, {percentiles}, max {max(lengths)}")
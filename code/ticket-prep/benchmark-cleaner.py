@@ -0,0 +1,211 @@
+import argparse
+import json
+import os
+import re
+import timeit
+from text_cleaner import TextCleaner
+
+# Previous clean_text of cleanup-tickets.py: patterns compiled on every call, four searches per word,
+# one re.sub per specific term and keyword
+def starts_with_datetime(line):
+    datetime_pattern = re.compile(r"^\d{2}\.\d{2}\.\d{4}[\t\s]+\d{2}:\d{2}:\d{2}")
+    return bool(datetime_pattern.match(line))
+
+def contains_telephone_number(line):
+    phone_pattern = re.compile(r'''
+        (\+?\d{1,4}[\s-]?)?  # Optional international code
+        (\(?\d{2,4}\)?[\s-]?)  # Area code with optional parentheses
+        \d{1,4}[\s-]?         # Main number segment 1
+        \d{1,4}[\s-]?         # Main number segment 2
+        \d{1,4}               # Main number segment 3
+        (?:[\s-]?\d{1,4})?    # Optional extension
+        (?:[\s-]?\d{1,4})?    # Optional additional segment
+    ''', re.VERBOSE)
+    return bool(phone_pattern.search(line))
+
+def contains_email(line):
+    email_pattern = re.compile(r'''
+        [a-zA-Z0-9._%+-]+       # Local part
+        @                       # @ symbol
+        [a-zA-Z0-9.-]+          # Domain part
+        \.[a-zA-Z]{2,}          # Top-level domain
+    ''', re.VERBOSE)
+    return bool(email_pattern.search(line))
+
+def contains_ip_address(line):
+    ip_pattern = re.compile(r'''
+        (?:\d{1,3}\.){3}\d{1,3}    # IPv4 address
+        |                          # OR
+        (?:[a-fA-F0-9]{1,4}:){7}[a-fA-F0-9]{1,4}   # IPv6 address
+    ''', re.VERBOSE)
+    return bool(ip_pattern.search(line))
+
+def contains_link(line):
+    url_pattern = re.compile(r'''
+        https?://[^\s/$.?#].[^\s]*    # Matches URLs with http or https schemes
+        |                            # OR
+        www\.[^\s/$.?#].[^\s]*        # Matches URLs starting with www
+    ''', re.VERBOSE)
+    return bool(url_pattern.search(line))
+
+def contains_date(line):
+    date_pattern = re.compile(r'''
+        \b\d{2}[-/]\d{2}[-/]\d{4}   # MM-DD-YYYY or DD-MM-YYYY
+        |                          # OR
+        \b\d{4}[-/]\d{2}[-/]\d{2}   # YYYY-MM-DD
+        |                          # OR
+        \b\d{2}[-/]\d{2}[-/]\d{2}   # MM-DD-YY or DD-MM-YY
+    ''', re.VERBOSE)
+    return bool(date_pattern.search(line))
+
+def starts_with_keyword(line, keywords):
+    return any(line.strip().startswith(keyword) for keyword in keywords)
+
+def is_empty_line(line):
+    return not line.strip()
+
+def replace_specific_terms(text, specific_terms):
+    for term, replacement in specific_terms.items():
+        text = re.sub(r'\b{}\b'.format(re.escape(term)), replacement, text, flags=re.IGNORECASE)
+    return text
+
+def legacy_clean_text(text, line_conditions, word_conditions, keywords, term_dict):
+    cleaned_lines = []
+    for line in text.split('\n'):
+        if not any(condition(line) for condition in line_conditions):
+            words = line.split()
+            cleaned_words = [word for word in words if not any(condition(word) for condition in word_conditions)]
+            cleaned_line = ' '.join(cleaned_words)
+            cleaned_lines.append(cleaned_line)
+
+    cleaned_text = '\n'.join(cleaned_lines)
+
+    # Replace specific terms
+    cleaned_text = replace_specific_terms(cleaned_text, term_dict)
+
+    # Replace keywords in the entire cleaned text
+    for keyword in keywords:
+        cleaned_text = re.sub(r'\b{}\b'.format(re.escape(keyword)), '', cleaned_text)
+
+    # Clean up any extra spaces and empty lines after keyword replacement
+    cleaned_text = '\n'.join(line.strip() for line in cleaned_text.splitlines() if line.strip())
+
+    return cleaned_text
+
+def legacy_cleaner(keywords, specific_terms):
+    line_conditions = [
+        starts_with_datetime,
+        lambda line: starts_with_keyword(line, keywords),
+        is_empty_line,
+        contains_telephone_number,
+    ]
+    word_conditions = [
+        contains_email,
+        contains_ip_address,
+        contains_link,
+        contains_date
+    ]
+    return lambda text: legacy_clean_text(text, line_conditions, word_conditions, keywords, specific_terms)
+
+# Worst case inputs of the detectors, shaped like texts pasted into tickets: (name, repeated unit).
+# Each text is a single line, the unit is repeated until the text has the benchmarked size.
+ADVERSARIAL_SHAPES = [
+    ("digit and dash runs of a log dump", "(12)-1-1x"),
+    ("register dump", "r1 0 r2 0 "),
+    ("stack trace on one line", "at com.example.Service.call(Service.java:12) "),
+    ("base64 attachment", "SGVsbG8gV29ybGQh"),
+    ("host name with numeric labels", "root@srv.01.a.1"),
+    ("dotted version list", "1.2.3-4.5/"),
+]
+
+def adversarial_text(unit, size):
+    return (unit * (size // len(unit) + 1))[:size]
+
+# Times the previous clean_text and the cleaner on every shape and size, the outputs have to be equal.
+# Linear matching shows up as a constant time per character over the sizes.
+def bench_adversarial(cleaner, legacy, sizes):
+    print(f"\n{'shape':<36} {'chars':>7} {'clean_text':>12} {'TextCleaner':>12} {'us/char':>8}")
+    failures = 0
+    for name, unit in ADVERSARIAL_SHAPES:
+        for size in sizes:
+            text = adversarial_text(unit, size)
+            legacy_seconds = min(timeit.repeat(lambda: legacy(text), number=1, repeat=2))
+            cleaner_seconds = min(timeit.repeat(lambda: cleaner.clean(text), number=1, repeat=2))
+            if legacy(text) != cleaner.clean(text):
+                failures += 1
+                print(f"Mismatch in shape '{name}' with {size} characters")
+            print(f"{name:<36} {size:>7} {legacy_seconds * 1000:9.2f} ms {cleaner_seconds * 1000:9.2f} ms {cleaner_seconds * 1e6 / size:8.3f}")
+    return failures
+
+def load_corpus(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+# Checks the cleaner against the expected outputs of the golden corpus, returns the number of differences
+def check_corpus(corpus, clean):
+    failures = 0
+    for case in corpus['cases']:
+        cleaned_text = clean(case['text'])
+        if cleaned_text != case['expected']:
+            failures += 1
+            print(f"Mismatch in case '{case['name']}':\n  expected: {case['expected']!r}\n  got:      {cleaned_text!r}")
+    return failures
+
+def bench(label, function, texts, repeat):
+    seconds = min(timeit.repeat(lambda: [function(text) for text in texts], number=1, repeat=repeat))
+    print(f"{label:<40} {seconds * 1000:10.2f} ms  ({len(texts) / seconds:10.1f} texts/s)")
+    return seconds
+
+if __name__ == "__main__":
+    default_corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden-corpus.json')
+
+    parser = argparse.ArgumentParser(description="Check the text cleaner against the golden corpus and compare it with the previous clean_text.")
+    parser.add_argument("--corpus", default=default_corpus, help="golden corpus (json with keywords, specific_terms and cases)")
+    parser.add_argument("--config", help="use keywords and specific_terms of this config.json for the benchmark")
+    parser.add_argument("--update", action="store_true", help="rewrite the expected outputs of the corpus with the current cleaner (review the diff!)")
+    parser.add_argument("--copies", type=int, default=50, help="number of copies of the corpus texts that are benchmarked")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--adversarial", action="store_true", help="also time the worst case inputs of the detectors")
+    parser.add_argument("--sizes", default="1000,4000,16000", help="text sizes (characters) of the worst case inputs")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    cleaner = TextCleaner(corpus['keywords'], corpus['specific_terms'])
+
+    if args.update:
+        for case in corpus['cases']:
+            case['expected'] = cleaner.clean(case['text'])
+        with open(args.corpus, 'w', encoding='utf-8') as file:
+            json.dump(corpus, file, indent=4, ensure_ascii=False)
+        print(f"Updated {len(corpus['cases'])} expected outputs in {args.corpus}")
+        print("Increase CLEANER_VERSION in text_cleaner.py if outputs changed, so the tickets are cleaned again")
+
+    # The cleaner has to reproduce the golden outputs before the timings mean anything
+    failures = check_corpus(corpus, cleaner.clean)
+    if failures:
+        raise SystemExit(f"{failures} golden corpus mismatches")
+    print(f"Golden corpus: {len(corpus['cases'])} cases identical")
+
+    keywords, specific_terms = corpus['keywords'], corpus['specific_terms']
+    if args.config:
+        with open(args.config, 'r') as file:
+            config = json.load(file)
+        keywords, specific_terms = config.get('keywords', []), config.get('specific_terms', {})
+        cleaner = TextCleaner(keywords, specific_terms)
+    legacy = legacy_cleaner(keywords, specific_terms)
+
+    texts = [case['text'] for case in corpus['cases']] * args.copies
+
+    # Single pass replacement does not replace terms inside the replacement text of another term
+    # (e.g. "Shell" inside the SSH explanation), the previous clean_text did
+    differences = sum(1 for case in corpus['cases'] if legacy(case['text']) != cleaner.clean(case['text']))
+    print(f"Cases with a different output than the previous clean_text: {differences}")
+
+    print(f"\n{len(texts)} texts, {len(keywords)} keywords, {len(specific_terms)} specific terms")
+    legacy_seconds = bench("clean_text (patterns per call)", legacy, texts, args.repeat)
+    cleaner_seconds = bench("TextCleaner.clean", cleaner.clean, texts, args.repeat)
+    print(f"Speedup: {legacy_seconds / cleaner_seconds:.2f}x")
+
+    if args.adversarial:
+        if bench_adversarial(cleaner, legacy, [int(size) for size in args.sizes.split(',')]):
+            raise SystemExit("Worst case inputs cleaned differently than by the previous clean_text")
@@ -1,86 +1,48 @@
 import logging
 import json
-import mysql.connector
+import os
+import sys
 from mysql.connector import Error, IntegrityError
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from database import Database
+from text_stats import TextStats
+
 class DB:
     def __init__(self, config):
-        self.user = config.get('db-user')
-        self.password = config.get('db-password')
-        self.host = config.get('db-host')
-        self.database = config.get('db-database')
-        
         try:
             # Connect to the database
-            self.connection = mysql.connector.connect(
-                host=self.host,
-                database=self.database,
-                user=self.user,
-                password=self.password
-            )
+            self.database = Database(config)
 
-            if self.connection.is_connected():
+            if self.database.is_connected():
                 print("Connection to the database was successful.")
             else:
                 print("Failed to connect to the database.")
         except Error as e:
             print(f"Error: {e}")
-            self.connection = None
+            self.database = None
         
     def __del__(self):
-        if self.connection and self.connection.is_connected():
-            self.connection.close()
-            print("Connection to the database was successfully closed.")
+        if self.database and self.database.is_connected():
+            self.database.release()
+            print("Connection to the database was successfully returned to the pool.")
         else:
             print("Failed to close the database connection.")
     
-    def get_tickets_counter(self):
-
-        try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
-
-                query = """
-                SELECT COUNT(*) FROM tickets_summary;
-                """
-
-                # Execute the query
-                cursor.execute(query,())
-                counter = cursor.fetchone()[0]
-                return int(counter)
-            else:
-                print("Failed to connect to the database.")
-        except Error as e:
-            print(f"Error: {e}")
-        finally:
-            if self.connection.is_connected():
-                cursor.close()
-
-    def read_tickets(self):
-        if self.connection is None:
+    # Yields the table as DataFrames of chunk_size rows
+    def iter_tickets(self, chunk_size):
+        if self.database is None:
             print("No connection to the database.")
-            return None
+            return
         
         query = "SELECT id, question, answer FROM tickets_summary"
         
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            
-            # Get column names
-            column_names = [i[0] for i in cursor.description]
-            
-            # Create DataFrame
-            df = pd.DataFrame(rows, columns=column_names)
-            
-            cursor.close()
-            
-            return df
+            for rows, column_names in self.database.iter_chunks(query, chunk_size=chunk_size):
+                yield pd.DataFrame(rows, columns=column_names)
         except Error as e:
             print(f"Error: {e}")
-            return None
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)  
@@ -91,8 +53,10 @@ if __name__ == "__main__":
 
     db = DB(config)
     
-    # Read and print the tickets table as a pandas DataFrame
-    tickets_df = db.read_tickets()
-    ticket_counter = db.get_tickets_counter()
-    print(f"Rows: {ticket_counter}")
-    print(tickets_df.head())
+    # Stream the tickets_summary table in chunks, print the first rows and the statistics
+    stats = TextStats(['question', 'answer'])
+    for tickets_df in db.iter_tickets(config.get('db-chunk-size', 500)):
+        if stats.rows == 0:
+            print(tickets_df.head())
+        stats.add(tickets_df)
+    stats.report()
@@ -1,301 +1,290 @@
-import mysql.connector
+import os
+import sys
 from mysql.connector import Error, IntegrityError
 import json
-import re
 import logging
-import pandas as pd
-
-def starts_with_datetime(line):
-    datetime_pattern = re.compile(r"^\d{2}\.\d{2}\.\d{4}[\t\s]+\d{2}:\d{2}:\d{2}")
-    return bool(datetime_pattern.match(line))
-
-def contains_telephone_number(line):
-    phone_pattern = re.compile(r'''
-        (\+?\d{1,4}[\s-]?)?  # Optional international code
-        (\(?\d{2,4}\)?[\s-]?)  # Area code with optional parentheses
-        \d{1,4}[\s-]?         # Main number segment 1
-        \d{1,4}[\s-]?         # Main number segment 2
-        \d{1,4}               # Main number segment 3
-        (?:[\s-]?\d{1,4})?    # Optional extension
-        (?:[\s-]?\d{1,4})?    # Optional additional segment
-    ''', re.VERBOSE)
-    return bool(phone_pattern.search(line))
-
-def contains_email(line):
-    email_pattern = re.compile(r'''
-        [a-zA-Z0-9._%+-]+       # Local part
-        @                       # @ symbol
-        [a-zA-Z0-9.-]+          # Domain part
-        \.[a-zA-Z]{2,}          # Top-level domain
-    ''', re.VERBOSE)
-    return bool(email_pattern.search(line))
-
-def contains_ip_address(line):
-    ip_pattern = re.compile(r'''
-        (?:\d{1,3}\.){3}\d{1,3}    # IPv4 address
-        |                          # OR
-        (?:[a-fA-F0-9]{1,4}:){7}[a-fA-F0-9]{1,4}   # IPv6 address
-    ''', re.VERBOSE)
-    return bool(ip_pattern.search(line))
-
-def contains_link(line):
-    url_pattern = re.compile(r'''
-        https?://[^\s/$.?#].[^\s]*    # Matches URLs with http or https schemes
-        |                            # OR
-        www\.[^\s/$.?#].[^\s]*        # Matches URLs starting with www
-    ''', re.VERBOSE)
-    return bool(url_pattern.search(line))
-
-def contains_date(line):
-    date_pattern = re.compile(r'''
-        \b\d{2}[-/]\d{2}[-/]\d{4}   # MM-DD-YYYY or DD-MM-YYYY
-        |                          # OR
-        \b\d{4}[-/]\d{2}[-/]\d{2}   # YYYY-MM-DD
-        |                          # OR
-        \b\d{2}[-/]\d{2}[-/]\d{2}   # MM-DD-YY or DD-MM-YY
-    ''', re.VERBOSE)
-    return bool(date_pattern.search(line))
-
-def starts_with_keyword(line, keywords):
-    return any(line.strip().startswith(keyword) for keyword in keywords)
-
-def is_empty_line(line):
-    return not line.strip()
-
-def replace_specific_terms(text, specific_terms):
-    for term, replacement in specific_terms.items():
-        text = re.sub(r'\b{}\b'.format(re.escape(term)), replacement, text, flags=re.IGNORECASE)
-    return text
-
-def clean_text(text, line_conditions, word_conditions, keywords, term_dict):
-    cleaned_lines = []
-    for line in text.split('\n'):
-        if not any(condition(line) for condition in line_conditions):
-            words = line.split()
-            cleaned_words = [word for word in words if not any(condition(word) for condition in word_conditions)]
-            cleaned_line = ' '.join(cleaned_words)
-            cleaned_lines.append(cleaned_line)
-
-    cleaned_text = '\n'.join(cleaned_lines)
-    
-    # Replace specific terms
-    cleaned_text = replace_specific_terms(cleaned_text, term_dict)
-    
-    # Replace keywords in the entire cleaned text
-    for keyword in keywords:
-        cleaned_text = re.sub(r'\b{}\b'.format(re.escape(keyword)), '', cleaned_text)
-
-    # Clean up any extra spaces and empty lines after keyword replacement
-    cleaned_text = '\n'.join(line.strip() for line in cleaned_text.splitlines() if line.strip())
-    
-    return cleaned_text
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from database import Database
+from pipeline import iter_pending_ids, count_pending_ids, mark_downstream_stale, CLEAR_STALE_QUERY, FLAG_QUERY
+from text_cleaner import TextCleaner, clean_batches, cleaner_config, cleaner_input, config_version, changed_entries, raw_hash, ENTRY_LENGTH
 
 class DB:
     def __init__(self, config):
-        self.user = config.get('db-user')
-        self.password = config.get('db-password')
-        self.host = config.get('db-host')
-        self.database = config.get('db-database')
-        
         # Connect to the database
-        self.connection = mysql.connector.connect(
-                host=self.host,
-                database=self.database,
-                user=self.user,
-                password=self.password
-            )
-
-        if self.connection.is_connected():
+        self.database = Database(config)
+
+        if self.database.is_connected():
             print("Connection to the database was successful.")
         else:
             print("Failed to connect to the database.")
         
     def __del__(self):
-        if self.connection.is_connected():
-            cursor = self.connection.cursor()
-            cursor.close()
-            self.connection.close()
-            print("Connection to the database was successfully closed.")
-        else:
-            print("Failed to close to the database connection.")
-
-    def check_ticket_exists_in_tickets_texts(self, ticket_id):
+        self.database.release()
+        print("Connection to the database was successfully returned to the pool.")
+
+    # Reads the cleaner input of a block of tickets with one query, together with the raw hash, config
+    # version and text of their current row in tickets_texts (stale tickets),
+    # returns {ticket_id: (cleaner_input, (raw_hash, config_version, text) or None)}
+    def read_tickets(self, ticket_ids):
+        query = """
+            SELECT t.id, t.text, t.title, t.category, c.id, c.raw_hash, c.config_version, c.text
+            FROM tickets t LEFT JOIN tickets_texts c ON c.id = t.id
+            WHERE t.id IN ({ids});
+        """
+        
         try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
-
-                query = "SELECT COUNT(*) FROM tickets_texts WHERE id = %s;"
-
-                cursor.execute(query, (ticket_id,))
-                counter = cursor.fetchone()[0]
-
-                return counter == 1
-            else:
-                print("Failed to connect to the database.")
+            rows = self.database.fetch_by_ids(query, ticket_ids)
+            return {
+                ticket_id: (
+                    cleaner_input(text, title, category_code),
+                    (previous_hash, previous_version, previous_text) if cleaned_id is not None else None
+                )
+                for ticket_id, text, title, category_code, cleaned_id, previous_hash, previous_version, previous_text in rows
+            }
+        except Error as e:
+            print(f"Error: {e}")
+            return {}
+
+    # Writes a batch of (ticket_id, cleaned_text, raw_hash, config_version) rows with one executemany upsert,
+    # replaces the occurring keywords and terms of the tickets and marks the downstream rows of the
+    # tickets in changed_ids stale
+    def insert_cleaned_texts(self, rows, entries, changed_ids):
+        if not rows:
+            return
+        try:
+            with self.database.transaction() as cursor:
+                query = """
+                    INSERT INTO tickets_texts (id, text, raw_hash, config_version) VALUES (%s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE text = VALUES(text), raw_hash = VALUES(raw_hash), config_version = VALUES(config_version);
+                """
+                cursor.executemany(query, rows)
+                cursor.executemany("DELETE FROM tickets_texts_entries WHERE id = %s;", [(row[0],) for row in rows])
+                if entries:
+                    cursor.executemany("INSERT IGNORE INTO tickets_texts_entries (entry, id) VALUES (%s, %s);", entries)
+                cursor.executemany(CLEAR_STALE_QUERY, [(row[0], 'tickets_texts') for row in rows])
+                if changed_ids:
+                    mark_downstream_stale(cursor, 'tickets_texts', changed_ids)
+            print(f"Inserted cleaned text for {len(rows)} tickets (IDs {rows[0][0]} - {rows[-1][0]}), {len(changed_ids)} changed.")
         except Error as e:
             print(f"Error: {e}")
-        finally:
-            if self.connection.is_connected():
-                cursor.close()
 
-    def get_tickets_counter(self):
+    # Stale tickets whose raw text and config version did not change keep their row
+    def clear_stale(self, ticket_ids):
+        if not ticket_ids:
+            return
         try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
+            with self.database.transaction() as cursor:
+                cursor.executemany(CLEAR_STALE_QUERY, [(ticket_id, 'tickets_texts') for ticket_id in ticket_ids])
+            print(f"Skipped {len(ticket_ids)} stale tickets with unchanged raw text.")
+        except Error as e:
+            print(f"Error: {e}")
 
-                query = "SELECT COUNT(*) FROM tickets;"
+    # Tickets over the time budget stay out of the pending tickets until their row in tickets_flagged is deleted
+    def flag_tickets(self, ticket_ids, reason):
+        if not ticket_ids:
+            return
+        try:
+            with self.database.transaction() as cursor:
+                cursor.executemany(FLAG_QUERY, [(ticket_id, 'tickets_texts', reason) for ticket_id in ticket_ids])
+            print(f"Flagged {len(ticket_ids)} tickets ({reason}): {', '.join(map(str, ticket_ids))}")
+        except Error as e:
+            print(f"Error: {e}")
 
-                cursor.execute(query)
-                counter = cursor.fetchone()[0]
-                return int(counter)
-            else:
-                print("Failed to connect to the database.")
+    def register_config(self, version, config):
+        try:
+            self.database.execute("INSERT IGNORE INTO cleanup_configs (version, config) VALUES (%s, %s);", (version, json.dumps(config, ensure_ascii=False)))
         except Error as e:
             print(f"Error: {e}")
-        finally:
-            if self.connection.is_connected():
-                cursor.close()
 
-    def read_ticket(self, ticket_id):
-        if self.connection is None:
-            print("No connection to the database.")
-            return None
-        
-        query = "SELECT id, text FROM tickets WHERE id = %s;"
-        
+    def read_config(self, version):
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, (ticket_id,))
-            rows = cursor.fetchall()
-            
-            column_names = [i[0] for i in cursor.description]
-            df = pd.DataFrame(rows, columns=column_names)
-            
-            cursor.close()
-            
-            return df
+            row = self.database.fetch_one("SELECT config FROM cleanup_configs WHERE version = %s;", (version,))
+            return json.loads(row[0]) if row else None
         except Error as e:
             print(f"Error: {e}")
             return None
 
-    def insert_cleaned_text(self, ticket_id, cleaned_text):
+    # Returns [(config_version, row count)] of tickets_texts, NULL for rows cleaned before config versions existed
+    def read_config_versions(self):
         try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
-
-                query = "INSERT INTO tickets_texts (id, text) VALUES (%s, %s);"
-                cursor.execute(query, (ticket_id, cleaned_text))
-                self.connection.commit()
-                print(f"Inserted cleaned text for ticket ID {ticket_id}.")
-        except IntegrityError:
-            print(f"Ticket ID {ticket_id} already exists in tickets_texts.")
+            return self.database.fetch_all("SELECT config_version, COUNT(*) FROM tickets_texts GROUP BY config_version;")
         except Error as e:
             print(f"Error: {e}")
-        finally:
-            if self.connection.is_connected():
-                cursor.close()
-    
-    def read_ticket_title(self, ticket_id):
-        if self.connection is None:
-            print("No connection to the database.")
-            return None
-        
-        query = "SELECT title FROM tickets WHERE id = %s;"
-        
+            return []
+
+    def mark_version_stale(self, version):
+        if version is None:
+            query = "INSERT IGNORE INTO tickets_stale (id, stage) SELECT id, 'tickets_texts' FROM tickets_texts WHERE config_version IS NULL;"
+        else:
+            query = "INSERT IGNORE INTO tickets_stale (id, stage) SELECT id, 'tickets_texts' FROM tickets_texts WHERE config_version = %s;"
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, (ticket_id,))
-            title = cursor.fetchone()
-            
-            cursor.close()
-            
-            return title[0] if title else None
+            with self.database.transaction() as cursor:
+                cursor.execute(query, () if version is None else (version,))
+                return cursor.rowcount
         except Error as e:
             print(f"Error: {e}")
-            return None
-        
-    def read_ticket_category(self, ticket_id):
-        if self.connection is None:
-            print("No connection to the database.")
-            return None
-        
-        query = "SELECT category FROM tickets WHERE id = %s;"
-        
-        # Define the category mapping
-        category_mapping = {
-            'INC': 'Incident',
-            'SRQ': 'Request',
-            'RFC': 'Request',
-            'CHI': 'Request',
-            'CHR': 'Request'
-        }
-        
+            return 0
+
+    # Marks the tickets of a config version stale in which one of the entries occurred (inverted index)
+    def mark_entries_stale(self, version, entries):
+        query = f"""
+            INSERT IGNORE INTO tickets_stale (id, stage)
+            SELECT DISTINCT e.id, 'tickets_texts' FROM tickets_texts_entries e JOIN tickets_texts t ON t.id = e.id
+            WHERE t.config_version = %s AND e.entry IN ({', '.join(['%s'] * len(entries))});
+        """
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, (ticket_id,))
-            category = cursor.fetchone()
-            
-            cursor.close()
-            
-            if category:
-                # Get the actual category code
-                category_code = category[0]
-                # Map the category code to the descriptive name
-                return category_mapping.get(category_code, 'Unknown Category')
-            else:
-                return None
+            with self.database.transaction() as cursor:
+                cursor.execute(query, (version, *entries))
+                return cursor.rowcount
         except Error as e:
             print(f"Error: {e}")
-            return None
+            return 0
 
+    def mark_stale(self, ticket_ids):
+        try:
+            with self.database.transaction() as cursor:
+                cursor.executemany("INSERT IGNORE INTO tickets_stale (id, stage) VALUES (%s, 'tickets_texts');", [(ticket_id,) for ticket_id in ticket_ids])
+        except Error as e:
+            print(f"Error: {e}")
 
+    # Streams (ticket_id, cleaner input, cleaned text) of the tickets of a config version that are not stale yet
+    def iter_version_tickets(self, version, chunk_size):
+        query = """
+            SELECT t.id, t.text, t.title, t.category, c.text FROM tickets_texts c JOIN tickets t ON t.id = c.id
+            WHERE c.config_version = %s AND c.id NOT IN (SELECT id FROM tickets_stale WHERE stage = 'tickets_texts');
+        """
+        for rows, _ in self.database.iter_chunks(query, (version,), chunk_size):
+            yield [(ticket_id, cleaner_input(text, title, category_code), cleaned_text)
+                   for ticket_id, text, title, category_code, cleaned_text in rows]
+
+    # The rows of an older config version that are not stale are cleaned the same with the current config
+    def update_config_version(self, old_version, version):
+        query = """
+            UPDATE tickets_texts SET config_version = %s
+            WHERE config_version = %s AND id NOT IN (SELECT id FROM tickets_stale WHERE stage = 'tickets_texts');
+        """
+        try:
+            return self.database.execute(query, (version, old_version))
+        except Error as e:
+            print(f"Error: {e}")
+            return 0
+
+# Finds the tickets cleaned with an older config that the current config cleans differently and marks
+# them stale, the other rows get the current config version without being cleaned again.
+# Entries of the older config are looked up in the inverted index tickets_texts_entries, entries that
+# are new in the current config were never indexed and are searched in the raw texts (keywords, terms)
+# or in the cleaned texts (boilerplate lines, they are lines of the output).
+def reconcile_config(db, config, version, chunk_size):
+    db.register_config(version, config)
+    boilerplate = config.get('boilerplate', [])
+    cleaner = TextCleaner(config['keywords'], config['specific_terms'], boilerplate)
+
+    for old_version, count in db.read_config_versions():
+        if old_version == version:
+            continue
+        old_config = db.read_config(old_version) if old_version is not None else None
+        if old_config is None or old_config['cleaner'] != config['cleaner']:
+            # No config to compare with (rows from before config versions) or changed cleaning rules
+            marked = db.mark_version_stale(old_version)
+            print(f"Config version {old_version}: all {count} tickets have to be cleaned again ({marked} marked stale)")
+            continue
+
+        changed = changed_entries(old_config, config)
+        old_entries = {*old_config['keywords'], *old_config['specific_terms'], *old_config.get('boilerplate', [])}
+        indexed = {entry for entry in changed if entry in old_entries}
+        new_lines = {entry for entry in changed if entry not in indexed and entry in cleaner.boilerplate}
+        new = [entry for entry in changed if entry not in indexed and entry in cleaner.entries]
+
+        marked = db.mark_entries_stale(old_version, sorted({entry[:ENTRY_LENGTH] for entry in indexed})) if indexed else 0
+        if new or new_lines:
+            for tickets in db.iter_version_tickets(old_version, chunk_size):
+                affected = [
+                    ticket_id for ticket_id, text, cleaned_text in tickets
+                    if (new_lines and not new_lines.isdisjoint((cleaned_text or '').split('\n')))
+                    or (new and cleaner.occurring_entries(cleaner.searchable_text(text), new))
+                ]
+                if affected:
+                    db.mark_stale(affected)
+                    marked += len(affected)
+
+        updated = db.update_config_version(old_version, version)
+        print(f"Config version {old_version}: {len(changed)} changed entries, {marked} of {count} tickets marked stale, {updated} kept")
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
 
+    parser = argparse.ArgumentParser(description="Clean the pending tickets into tickets_texts.")
+    parser.add_argument("--workers", type=int, help="number of cleaning processes (default: cleanup-workers of config.json or 1)")
+    args = parser.parse_args()
+
     with open('config.json', 'r') as file:
         config = json.load(file)
 
     keywords = config.get('keywords', [])
     specific_terms = config.get('specific_terms', {})
 
-    line_conditions = [
-        starts_with_datetime,
-        lambda line: starts_with_keyword(line, keywords),
-        is_empty_line,
-        contains_telephone_number,
-    ]
-
-    word_conditions = [
-        contains_email,
-        contains_ip_address,
-        contains_link,
-        contains_date
-    ]
-
     db = DB(config)
 
-    ticket_id = 11851846 # 01.06.2024
-    
-    ticket_counter = db.get_tickets_counter()
-    print(f"Rows: {ticket_counter}")
-
-    for counter in range(ticket_counter):
-        if not db.check_ticket_exists_in_tickets_texts(ticket_id):
-            ticket_df = db.read_ticket(ticket_id)
-            if not ticket_df.empty:
-                title = db.read_ticket_title(ticket_id)
-                category = db.read_ticket_category(ticket_id)
-                raw_text = ticket_df.loc[0, 'text']
-                
-                if category and title:
-                    # Prepend the category and title to the cleaned text
-                    raw_text = f"{category}\nTitle: {title}\n\n{raw_text}"
-
-                cleaned_text = clean_text(raw_text, line_conditions, word_conditions, keywords, specific_terms)
-
-                db.insert_cleaned_text(ticket_id, cleaned_text)
-        else:
-            print(f"Ticket ID {ticket_id} already exists in tickets_texts.")
-
-        ticket_id = ticket_id - 1
+    chunk_size = config.get('db-chunk-size', 500)
+    batch_size = config.get('cleanup-batch-size', 50)
+    workers = args.workers or config.get('cleanup-workers', 1)
+    time_budget = config.get('cleanup-time-budget', 2.0)
+
+    # Boilerplate lines found by find-boilerplate.py --write
+    boilerplate = []
+    boilerplate_file = config.get('boilerplate-file', 'boilerplate.json')
+    if os.path.exists(boilerplate_file):
+        with open(boilerplate_file, 'r', encoding='utf-8') as file:
+            boilerplate = json.load(file)
+        print(f"Boilerplate lines: {len(boilerplate)} ({boilerplate_file})")
+
+    # Rows of an older config are cleaned again if the config change affects them
+    config_fingerprint = cleaner_config(keywords, specific_terms, boilerplate)
+    version = config_version(config_fingerprint)
+    print(f"Config version: {version}")
+    reconcile_config(db, config_fingerprint, version, chunk_size)
+
+    print(f"Pending tickets: {count_pending_ids(db.database, 'tickets_texts')}")
+
+    # Raw hash and previous text of the tickets between reading and writing
+    previous_rows = {}
+
+    # Producer: pending tickets in batches of (ticket_id, raw_text)
+    def iter_batches():
+        for ticket_ids in iter_pending_ids(db.database, 'tickets_texts', chunk_size):
+            tickets = db.read_tickets(ticket_ids)
+            batch = []
+            unchanged = []
+            for ticket_id in ticket_ids:
+                if ticket_id in tickets:
+                    raw_text, previous = tickets[ticket_id]
+                    ticket_hash = raw_hash(raw_text)
+
+                    # Stale because of a change of the ticket that did not touch its text (e.g. status)
+                    if previous and previous[0] == ticket_hash and previous[1] == version:
+                        unchanged.append(ticket_id)
+                        continue
+
+                    previous_rows[ticket_id] = (ticket_hash, previous[2] if previous else None)
+                    batch.append((ticket_id, raw_text))
+            db.clear_stale(unchanged)
+            for offset in range(0, len(batch), batch_size):
+                yield batch[offset:offset + batch_size]
+
+    # Cleaning in this process or in the process pool, writing in this process only
+    for cleaned_batch in clean_batches(iter_batches(), keywords, specific_terms, boilerplate, workers, time_budget):
+        rows, entries, changed_ids, flagged_ids = [], [], [], []
+        for ticket_id, cleaned_text, occurring in cleaned_batch:
+            ticket_hash, previous_text = previous_rows.pop(ticket_id)
+            if cleaned_text is None:
+                flagged_ids.append(ticket_id)
+                continue
+            rows.append((ticket_id, cleaned_text, ticket_hash, version))
+            entries.extend((entry[:ENTRY_LENGTH], ticket_id) for entry in occurring)
+            # Downstream stages only have to rebuild rows whose cleaned text changed
+            if previous_text is not None and previous_text != cleaned_text:
+                changed_ids.append(ticket_id)
+        db.insert_cleaned_texts(rows, entries, changed_ids)
+        db.flag_tickets(flagged_ids, f"cleaning took longer than {time_budget} seconds")
@@ -0,0 +1,141 @@
+import os
+import sys
+from collections import Counter
+from mysql.connector import Error, IntegrityError
+import json
+import logging
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from database import Database
+from text_cleaner import CATEGORY_MAPPING, ENTRY_LENGTH
+
+# Rough size of a llama token for German and English ticket texts
+CHARS_PER_TOKEN = 4
+
+# sum-tickets.py sends every cleaned text twice (question and answer prompt)
+PROMPTS_PER_TICKET = 2
+
+# First line of the cleaner input, recurs in every ticket but is no boilerplate
+HEADER_LINES = {*CATEGORY_MAPPING.values(), 'Unknown Category'}
+
+class DB:
+    def __init__(self, config):
+        # Connect to the database
+        self.database = Database(config)
+
+        if self.database.is_connected():
+            print("Connection to the database was successful.")
+        else:
+            print("Failed to connect to the database.")
+
+    def __del__(self):
+        self.database.release()
+        print("Connection to the database was successfully returned to the pool.")
+
+    # Yields the cleaned texts of tickets_texts in chunks
+    def iter_texts(self, chunk_size):
+        query = "SELECT text FROM tickets_texts"
+
+        try:
+            for rows, _ in self.database.iter_chunks(query, chunk_size=chunk_size):
+                yield [text for text, in rows if text]
+        except Error as e:
+            print(f"Error: {e}")
+
+    # Lines that are boilerplate already are no longer in tickets_texts, the index of cleanup-tickets.py
+    # still knows the tickets they were removed from. Returns {line: ticket count}.
+    def count_removed_lines(self, lines):
+        prefixes = {line[:ENTRY_LENGTH]: line for line in lines}
+        if not prefixes:
+            return {}
+        query = f"SELECT entry, COUNT(*) FROM tickets_texts_entries WHERE entry IN ({', '.join(['%s'] * len(prefixes))}) GROUP BY entry;"
+
+        try:
+            return {prefixes[entry]: count for entry, count in self.database.fetch_all(query, tuple(prefixes))}
+        except Error as e:
+            print(f"Error: {e}")
+            return {}
+
+# Document frequency of the cleaned lines: every line counts once per ticket. The index is keyed by the
+# hash of the line, the text is only kept for lines seen in a second ticket.
+class LineIndex:
+    def __init__(self):
+        self.tickets = 0
+        self.chars = 0
+        self.counts = Counter()
+        self.lines = {}
+
+    def add(self, text):
+        self.tickets += 1
+        self.chars += len(text)
+        for line in set(text.split('\n')):
+            if line in HEADER_LINES:
+                continue
+            key = hash(line)
+            self.counts[key] += 1
+            if self.counts[key] == 2:
+                self.lines[key] = line
+
+    # {line: ticket count} of the lines that occur in more than one ticket
+    def repeated_lines(self):
+        return {self.lines[key]: count for key, count in self.counts.items() if count >= 2}
+
+def estimated_tokens(chars):
+    return chars // CHARS_PER_TOKEN
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    with open('config.json', 'r') as file:
+        config = json.load(file)
+
+    parser = argparse.ArgumentParser(description="Find lines of tickets_texts that recur in many tickets (signatures, disclaimers, monitoring templates).")
+    parser.add_argument("--min-share", type=float, default=config.get('boilerplate-min-share', 2.0), help="percentage of tickets a line has to occur in (default: boilerplate-min-share of config.json or 2.0)")
+    parser.add_argument("--min-tickets", type=int, default=20, help="number of tickets a line has to occur in at least")
+    parser.add_argument("--top", type=int, default=30, help="number of lines printed")
+    parser.add_argument("--write", action="store_true", help="write the lines to the boilerplate file that cleanup-tickets.py reads")
+    args = parser.parse_args()
+
+    boilerplate_file = config.get('boilerplate-file', 'boilerplate.json')
+    boilerplate = []
+    if os.path.exists(boilerplate_file):
+        with open(boilerplate_file, 'r', encoding='utf-8') as file:
+            boilerplate = json.load(file)
+
+    db = DB(config)
+
+    # Stream the tickets_texts table once, only the line hashes and their counts are kept
+    index = LineIndex()
+    for texts in db.iter_texts(config.get('db-chunk-size', 500)):
+        for text in texts:
+            index.add(text)
+    if not index.tickets:
+        raise SystemExit("No cleaned tickets in tickets_texts.")
+
+    # Current boilerplate lines count with the tickets they are removed from
+    counts = index.repeated_lines()
+    removed = db.count_removed_lines(boilerplate)
+    removed_chars = sum(count * (len(line) + 1) for line, count in removed.items())
+    for line, count in removed.items():
+        counts[line] = counts.get(line, 0) + count
+
+    min_tickets = max(args.min_tickets, index.tickets * args.min_share / 100)
+    found = sorted(((count, line) for line, count in counts.items() if count >= min_tickets), reverse=True)
+
+    print(f"\nTickets: {index.tickets}, distinct lines: {len(index.counts)}, boilerplate: {len(found)} lines in at least {min_tickets:.0f} tickets ({args.min_share}%)")
+    for count, line in found[:args.top]:
+        print(f"{100 * count / index.tickets:6.1f}%  {count:7}  {line[:100]}")
+
+    # Savings against the texts without any boilerplate removal, each removed line with its line break
+    total_chars = index.chars + removed_chars
+    saved_chars = sum(count * (len(line) + 1) for count, line in found)
+    print(f"\nCharacters: {total_chars}, boilerplate: {saved_chars} ({100 * saved_chars / max(total_chars, 1):.1f}%)")
+    saved_tokens = estimated_tokens(saved_chars) * PROMPTS_PER_TICKET
+    print(f"Estimated tokens saved per sum-tickets.py run: {saved_tokens} ({saved_tokens / index.tickets:.1f} per ticket, {PROMPTS_PER_TICKET} prompts each)")
+
+    if args.write:
+        lines = [line for _, line in found]
+        with open(boilerplate_file, 'w', encoding='utf-8') as file:
+            json.dump(lines, file, indent=4, ensure_ascii=False)
+        print(f"\nWrote {len(lines)} lines to {boilerplate_file}, run cleanup-tickets.py to clean the affected tickets again")
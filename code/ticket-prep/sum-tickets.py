@@ -1,140 +1,52 @@
 import requests
 import json
-import mysql.connector
+import os
+import sys
 from mysql.connector import Error, IntegrityError
 import logging
 import pandas as pd
 import random
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from database import Database
+from pipeline import iter_pending_ids, count_pending_ids, CLEAR_STALE_QUERY
+
 class DB:
     def __init__(self, config):
-        self.user = config.get('db-user')
-        self.password = config.get('db-password')
-        self.host = config.get('db-host')
-        self.database = config.get('db-database')
-        
         # Connect to the database
-        self.connection = mysql.connector.connect(
-                host=self.host,
-                database=self.database,
-                user=self.user,
-                password=self.password
-            )
+        self.database = Database(config)
 
-        if self.connection.is_connected():
+        if self.database.is_connected():
             print("Connection to the database was successful.")
         else:
             print("Failed to connect to the database.")
         
     def __del__(self):
-        if self.connection.is_connected():
-            cursor = self.connection.cursor()
-            cursor.close()
-            self.connection.close()
-            print("Connection to the database was successfully closed.")
-        else:
-            print("Failed to close the database connection.")
-
-    def check_ticket_exists_in_tickets_texts(self, ticket_id):
-        try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
-
-                query = "SELECT COUNT(*) FROM tickets_texts_cleaned WHERE id = %s;"
-
-                cursor.execute(query, (ticket_id,))
-                counter = cursor.fetchone()[0]
-
-                return counter == 1
-            else:
-                print("Failed to connect to the database.")
-        except Error as e:
-            print(f"Error: {e}")
-        finally:
-            if self.connection.is_connected():
-                cursor.close()
-
-    def check_ticket_exists_in_tickets_summary(self, ticket_id):
-        try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
-
-                query = "SELECT COUNT(*) FROM tickets_summary WHERE id = %s;"
-
-                cursor.execute(query, (ticket_id,))
-                counter = cursor.fetchone()[0]
-
-                return counter == 1
-            else:
-                print("Failed to connect to the database.")
-        except Error as e:
-            print(f"Error: {e}")
-        finally:
-            if self.connection.is_connected():
-                cursor.close()
-
-    def get_tickets_counter(self):
-        try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
-
-                query = "SELECT COUNT(*) FROM tickets_texts_cleaned;"
-
-                cursor.execute(query)
-                counter = cursor.fetchone()[0]
-                return int(counter)
-            else:
-                print("Failed to connect to the database.")
-        except Error as e:
-            print(f"Error: {e}")
-        finally:
-            if self.connection.is_connected():
-                cursor.close()
+        self.database.release()
+        print("Connection to the database was successfully returned to the pool.")
 
     def read_cleaned_ticket(self, ticket_id):
-        if self.connection is None:
-            print("No connection to the database.")
-            return None
-        
         query = "SELECT id, text FROM tickets_texts_cleaned WHERE id = %s;"
         
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, (ticket_id,))
-            rows = cursor.fetchall()
-            
-            column_names = [i[0] for i in cursor.description]
-            df = pd.DataFrame(rows, columns=column_names)
-            
-            cursor.close()
-            
-            return df
+            rows, column_names = self.database.fetch_all_with_columns(query, (ticket_id,))
+            return pd.DataFrame(rows, columns=column_names)
         except Error as e:
             print(f"Error: {e}")
             return None
         
+    # Upsert, stale tickets already have a row
     def insert_summed_text(self, ticket_id, question, answer):
         try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
-
-                query = "INSERT INTO tickets_summary (id, question, answer) VALUES (%s, %s, %s);"
+            with self.database.transaction() as cursor:
+                query = "INSERT INTO tickets_summary (id, question, answer) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE question = VALUES(question), answer = VALUES(answer);"
                 cursor.execute(query, (ticket_id, question, answer))
-                self.connection.commit()
-                print(f"Inserted summary text for ticket ID {ticket_id}.")
-        except IntegrityError:
-            print(f"Ticket ID {ticket_id} already exists in tickets_summary.")
+                cursor.execute(CLEAR_STALE_QUERY, (ticket_id, 'tickets_summary'))
+            print(f"Inserted summary text for ticket ID {ticket_id}.")
         except Error as e:
             print(f"Error: {e}")
-        finally:
-            if self.connection.is_connected():
-                cursor.close()
 
     def read_ticket_category(self, ticket_id):
-        if self.connection is None:
-            print("No connection to the database.")
-            return 'Incident'
-        
         query = "SELECT category FROM tickets WHERE id = %s;"
         
         category_mapping = {
@@ -146,11 +58,7 @@ class DB:
         }
         
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, (ticket_id,))
-            category = cursor.fetchone()
-            
-            cursor.close()
+            category = self.database.fetch_one(query, (ticket_id,))
             
             if category:
                 category_code = category[0]
@@ -170,10 +78,9 @@ if __name__ == "__main__":
 
     db = DB(config)
 
-    ticket_id = 11851846 # 01.06.2024
-    
-    ticket_counter = db.get_tickets_counter()
-    print(f"Cleaned ticket texts: {ticket_counter}")
+    chunk_size = config.get('db-chunk-size', 500)
+
+    print(f"Pending tickets: {count_pending_ids(db.database, 'tickets_summary')}")
 
     question_prompts = [
         "The following text is an IT {CATEGORY} ticket. Please summarize the ticket by focusing on the issue, including the type, affected systems or components, potential causes, and the impact on users or operations. The summary should be concise (no more than five sentences), maintaining a technical tone suitable for a general audience of IT professionals. Use present tense and english language. Begin directly with the summary, avoiding any introductory or closing remarks.",
@@ -284,43 +191,39 @@ if __name__ == "__main__":
         
         return response
 
-    for counter in range(ticket_counter):
-        if not db.check_ticket_exists_in_tickets_summary(ticket_id):
+    for ticket_ids in iter_pending_ids(db.database, 'tickets_summary', chunk_size):
+        for ticket_id in ticket_ids:
             print(f"### Process: {ticket_id} ###")
-            if db.check_ticket_exists_in_tickets_texts(ticket_id):
-                ticket_df = db.read_cleaned_ticket(ticket_id)
-                if not ticket_df.empty:
-                    cleaned_text = ticket_df.loc[0, 'text']
+            ticket_df = db.read_cleaned_ticket(ticket_id)
+            if not ticket_df.empty:
+                cleaned_text = ticket_df.loc[0, 'text']
 
-                    ticket_category = db.read_ticket_category(ticket_id)
+                ticket_category = db.read_ticket_category(ticket_id)
 
-                    # Select random prompts
-                    question_prompts = [p.format(CATEGORY=ticket_category) for p in question_prompts]
-                    answer_prompts = [p.format(CATEGORY=ticket_category) for p in answer_prompts]
-                    question_prompt = random.choice(question_prompts)
-                    answer_prompt = random.choice(answer_prompts)
+                # Select random prompts
+                question_prompts = [p.format(CATEGORY=ticket_category) for p in question_prompts]
+                answer_prompts = [p.format(CATEGORY=ticket_category) for p in answer_prompts]
+                question_prompt = random.choice(question_prompts)
+                answer_prompt = random.choice(answer_prompts)
 
-                    url = "http://devcontainer_ollama:11434/api/generate"
+                url = "http://devcontainer_ollama:11434/api/generate"
 
-                    headers = {
-                        "Content-Type": "application/json"
-                    }
+                headers = {
+                    "Content-Type": "application/json"
+                }
 
-                    # API call for question
-                    question = process_ticket(url, headers, question_prompt, cleaned_text)
-                    if not question:
-                        continue  # Skip to next ticket if API call fails
+                # API call for question
+                question = process_ticket(url, headers, question_prompt, cleaned_text)
+                if not question:
+                    continue  # Skip to next ticket if API call fails
 
-                    print("question: " + question)
+                print("question: " + question)
 
-                    # API call for answer
-                    answer = process_ticket(url, headers, answer_prompt, cleaned_text)
-                    if not answer:
-                        continue  # Skip to next ticket if API call fails
+                # API call for answer
+                answer = process_ticket(url, headers, answer_prompt, cleaned_text)
+                if not answer:
+                    continue  # Skip to next ticket if API call fails
 
-                    print("answer: " + answer)
+                print("answer: " + answer)
 
-                    db.insert_summed_text(ticket_id, question, answer)
-        else:
-            print(f"Ticket ID {ticket_id} already exists in tickets_summary.")
-        ticket_id = ticket_id - 1
+                db.insert_summed_text(ticket_id, question, answer)
@@ -0,0 +1,308 @@
+import hashlib
+import json
+import re
+import time
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Line conditions: a line is dropped if it starts with a timestamp or contains a telephone number
+DATETIME_PATTERN = re.compile(r"^\d{2}\.\d{2}\.\d{4}[\t\s]+\d{2}:\d{2}:\d{2}")
+
+# Previous telephone number pattern, contains_phone_number finds the same lines without backtracking
+PHONE_PATTERN = re.compile(r'''
+    (\+?\d{1,4}[\s-]?)?  # Optional international code
+    (\(?\d{2,4}\)?[\s-]?)  # Area code with optional parentheses
+    \d{1,4}[\s-]?         # Main number segment 1
+    \d{1,4}[\s-]?         # Main number segment 2
+    \d{1,4}               # Main number segment 3
+    (?:[\s-]?\d{1,4})?    # Optional extension
+    (?:[\s-]?\d{1,4})?    # Optional additional segment
+''', re.VERBOSE)
+
+DIGITS = re.compile(r'\d+')
+PHONE_AREA_CODE_GAP = re.compile(r'\)?[\s-]?')
+PHONE_GAP = re.compile(r'[\s-]')
+
+# A line matches PHONE_PATTERN if it contains four digit groups, the first with 2-4 digits (area code),
+# the others with 1-4 digits, separated by at most one whitespace or '-' (and a ')' after the area code).
+# The optional parts can be left out for the search. Groups may follow each other without a separator,
+# so five digits in a row are enough. Checked on the digit runs of the line, every run is looked at
+# from at most four windows: linear time, no backtracking on long digit-and-space runs.
+def contains_phone_number(line):
+    runs = [(match.start(), match.end()) for match in DIGITS.finditer(line)]
+    if any(end - start >= 5 for start, end in runs):
+        return True
+
+    for index, (start, end) in enumerate(runs):
+        if end - start < 2:
+            continue
+        # Digits the window can give to the groups: the area code needs two of the first run,
+        # after a ')' the first run can only hold the area code
+        capacity = end - start - 1
+        for group_count, (next_start, next_end) in enumerate(runs[index + 1:index + 4], start=2):
+            gap = line[runs[index + group_count - 2][1]:next_start]
+            if group_count == 2:
+                if not PHONE_AREA_CODE_GAP.fullmatch(gap):
+                    break
+                if ')' in gap:
+                    capacity = 1
+            elif not PHONE_GAP.fullmatch(gap):
+                break
+            capacity += next_end - next_start
+            if capacity >= 4:
+                return True
+    return False
+
+# Word conditions (email, ip address, link, date) fused into one alternation. None of the branches
+# can match whitespace, so every match lies inside a single word of the line and one scan of the
+# line finds all words to drop. The character after the scheme/www of a link is \S instead of '.',
+# a link split by whitespace never matched the single word either. The email branch starts at the '@'
+# (lookbehind for the local part): starting at every character of the local part was quadratic in
+# the length of long words such as pasted base64 blobs.
+WORD_PATTERN = re.compile(r'''
+    (?<=[a-zA-Z0-9._%+-])@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}      # Email
+    | (?:\d{1,3}\.){3}\d{1,3}                               # IPv4 address
+    | (?:[a-fA-F0-9]{1,4}:){7}[a-fA-F0-9]{1,4}              # IPv6 address
+    | https?://[^\s/$.?#]\S+                                # Link with http or https scheme
+    | www\.[^\s/$.?#]\S+                                    # Link starting with www
+    | \b\d{2}[-/]\d{2}[-/]\d{4}                             # MM-DD-YYYY or DD-MM-YYYY
+    | \b\d{4}[-/]\d{2}[-/]\d{2}                             # YYYY-MM-DD
+    | \b\d{2}[-/]\d{2}[-/]\d{2}                             # MM-DD-YY or DD-MM-YY
+''', re.VERBOSE)
+
+WORD = re.compile(r'\S+')
+
+# Part of the config version, increase it with every change of the cleaning rules in this file
+# that changes the output (golden-corpus.json --update), all tickets are cleaned again then
+CLEANER_VERSION = 1
+
+# Category code of a ticket -> descriptive name
+CATEGORY_MAPPING = {
+    'INC': 'Incident',
+    'SRQ': 'Request',
+    'RFC': 'Request',
+    'CHI': 'Request',
+    'CHR': 'Request'
+}
+
+# Length of tickets_texts_entries.entry, longer entries are indexed by their prefix
+ENTRY_LENGTH = 255
+
+# Text the cleaner gets for a ticket, raw_hash is computed from it
+def cleaner_input(text, title, category_code):
+    category = CATEGORY_MAPPING.get(category_code, 'Unknown Category')
+    if category and title:
+        # Prepend the category and title to the cleaned text
+        return f"{category}\nTitle: {title}\n\n{text}"
+    return text
+
+# Everything the output of TextCleaner depends on besides the raw text. Boilerplate lines
+# (find-boilerplate.py) are only part of it if there are any, older configs keep their version.
+def cleaner_config(keywords, specific_terms, boilerplate=()):
+    config = {'cleaner': CLEANER_VERSION, 'keywords': list(keywords), 'specific_terms': dict(specific_terms)}
+    if boilerplate:
+        config['boilerplate'] = sorted(set(boilerplate))
+    return config
+
+def config_version(config):
+    return hashlib.sha256(json.dumps(config, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+# (kind, entry, replacement) in the order of the alternation of TextCleaner
+def _rules(config):
+    rules = [('term', term, replacement) for term, replacement in config['specific_terms'].items() if term]
+    rules.extend(('keyword', keyword, '') for keyword in config['keywords'] if keyword)
+    rules.extend(('line', line, '') for line in config.get('boilerplate', []))
+    return rules
+
+# Keywords, specific terms and boilerplate lines whose rule differs between two configs: added, removed,
+# changed replacement or kind, or moved relative to another entry (the earlier entry wins at the same
+# position). Only tickets in which one of them occurs can be cleaned differently.
+def changed_entries(old_config, new_config):
+    old_rules, new_rules = _rules(old_config), _rules(new_config)
+    changed = {entry for _, entry, _ in set(old_rules) ^ set(new_rules)}
+
+    common = set(old_rules) & set(new_rules)
+    old_order = [rule for rule in old_rules if rule in common]
+    new_order = [rule for rule in new_rules if rule in common]
+    for old_rule, new_rule in zip(old_order, new_order):
+        if old_rule != new_rule:
+            changed.update((old_rule[1], new_rule[1]))
+    return changed
+
+# Casefolding for substring checks that have to find everything the case-insensitive patterns can match:
+# re lowercases 'İ' to 'i' and treats 'ı' like 'i', casefold() does neither
+def fold(text):
+    return text.casefold().replace('i\u0307', 'i').replace('\u0131', 'i')
+
+def raw_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+# Raised by TextCleaner.clean_with_entries when the deadline of a ticket passed
+class CleaningTimeout(Exception):
+    pass
+
+class TextCleaner:
+    # Compiled once per run from the keywords and specific terms of config.json and the boilerplate lines
+    def __init__(self, keywords, specific_terms, boilerplate=()):
+        self.keywords = list(keywords)
+        self.line_prefixes = tuple(self.keywords)
+        # Cleaned lines that recur in many tickets (signatures, disclaimers), one set lookup per line
+        self.boilerplate = frozenset(boilerplate)
+
+        # Specific terms (case-insensitive) and keywords (removed) as one alternation, one group per
+        # entry. Entries keep the order of config.json, so at the same position the earlier entry wins
+        # like it did when every entry was a re.sub of its own.
+        self.branches = []
+        self.replacements = []
+        self.folded_entries = []
+        for term, replacement in specific_terms.items():
+            if term:
+                self.branches.append(r'((?i:\b{}\b))'.format(re.escape(term)))
+                self.replacements.append(replacement)
+                self.folded_entries.append(fold(term))
+        for keyword in self.keywords:
+            if keyword:
+                self.branches.append(r'(\b{}\b)'.format(re.escape(keyword)))
+                self.replacements.append('')
+                self.folded_entries.append(fold(keyword))
+        self.entries = list(dict.fromkeys(entry for entry in [*specific_terms, *self.keywords] if entry))
+        self.folded = {entry: fold(entry) for entry in self.entries}
+        self._replace_patterns = {}
+
+    # The alternation of all entries tries every branch at every position of the text (several
+    # microseconds per character), so it is built only from the entries that occur in the text.
+    # An entry that is not a folded substring of the text cannot match. Patterns are cached
+    # by the set of occurring entries.
+    def _replace_pattern(self, folded_text):
+        indices = tuple(index for index, entry in enumerate(self.folded_entries) if entry in folded_text)
+        if not indices:
+            return None, None
+        cached = self._replace_patterns.get(indices)
+        if cached is None:
+            if len(self._replace_patterns) >= 4096:
+                self._replace_patterns.clear()
+            pattern = re.compile('|'.join(self.branches[index] for index in indices))
+            replacements = [self.replacements[index] for index in indices]
+            cached = self._replace_patterns[indices] = (pattern, lambda match: replacements[match.lastindex - 1])
+        return cached
+
+    # Lines that are empty, start with a timestamp or contain a telephone number are dropped whatever the config is
+    def is_content_line(self, line):
+        return bool(line.strip()) and DATETIME_PATTERN.match(line) is None and not contains_phone_number(line)
+
+    def drop_line(self, line):
+        stripped = line.strip()
+        return (
+            not stripped
+            or stripped.startswith(self.line_prefixes)
+            or DATETIME_PATTERN.match(line) is not None
+            or contains_phone_number(line)
+        )
+
+    # Removes the words that contain an email, ip address, link or date and joins the rest with single spaces
+    def clean_line(self, line):
+        match_starts = [match.start() for match in WORD_PATTERN.finditer(line)]
+        if not match_starts:
+            return ' '.join(line.split())
+
+        words = []
+        for word in WORD.finditer(line):
+            # The word is dropped if a match starts inside of it
+            index = bisect_right(match_starts, word.end() - 1)
+            if index and match_starts[index - 1] >= word.start():
+                continue
+            words.append(word.group())
+        return ' '.join(words)
+
+    def _replace(self, cleaned_text):
+        # Replace specific terms and remove keywords in one pass over the cleaned text
+        pattern, replacement = self._replace_pattern(fold(cleaned_text))
+        if pattern:
+            cleaned_text = pattern.sub(replacement, cleaned_text)
+
+        # Clean up any extra spaces and empty lines after keyword replacement
+        return [line.strip() for line in cleaned_text.splitlines() if line.strip()]
+
+    def clean(self, text):
+        lines = self._replace('\n'.join(self.clean_line(line) for line in text.split('\n') if not self.drop_line(line)))
+        return '\n'.join(line for line in lines if line not in self.boilerplate)
+
+    # Returns the cleaned text and the keywords, specific terms and boilerplate lines that occur in the text.
+    # The deadline (time.perf_counter()) is checked before every line and before the passes over the
+    # whole text, so a single long line cannot run the replacement past it either.
+    def clean_with_entries(self, text, deadline=None):
+        def check_deadline():
+            if deadline is not None and time.perf_counter() > deadline:
+                raise CleaningTimeout()
+
+        kept_lines = []
+        searched_lines = [text]
+        for line in text.split('\n'):
+            check_deadline()
+            if not self.is_content_line(line):
+                continue
+            cleaned_line = self.clean_line(line)
+            searched_lines.append(cleaned_line)
+            if not line.strip().startswith(self.line_prefixes):
+                kept_lines.append(cleaned_line)
+
+        searched_text = fold('\n'.join(searched_lines))
+        check_deadline()
+        lines = self._replace('\n'.join(kept_lines))
+        check_deadline()
+        boilerplate = list(dict.fromkeys(line for line in lines if line in self.boilerplate))
+        cleaned_text = '\n'.join(line for line in lines if line not in self.boilerplate)
+        return cleaned_text, self.occurring_entries(searched_text) + boilerplate
+
+    # Raw text plus its lines without the removed words, folded. Lines dropped for a keyword prefix
+    # are included, so every keyword or term that can change the output of clean() is a substring of it,
+    # whatever the keywords and terms of the config are.
+    def searchable_text(self, text):
+        lines = [self.clean_line(line) for line in text.split('\n') if self.is_content_line(line)]
+        return fold('\n'.join([text, *lines]))
+
+    def occurring_entries(self, searched_text, entries=None):
+        if entries is None:
+            return [entry for entry, folded in self.folded.items() if folded in searched_text]
+        return [entry for entry in entries if fold(entry) in searched_text]
+
+# Process pool workers of cleanup-tickets.py --workers, every process builds its cleaner once
+_worker_cleaner = None
+_worker_time_budget = None
+
+def init_worker(keywords, specific_terms, boilerplate=(), time_budget=None):
+    global _worker_cleaner, _worker_time_budget
+    _worker_cleaner = TextCleaner(keywords, specific_terms, boilerplate)
+    _worker_time_budget = time_budget
+
+# Tickets that need more than the time budget (seconds) are not cleaned, their cleaned text is None
+def clean_ticket(ticket_id, text):
+    deadline = time.perf_counter() + _worker_time_budget if _worker_time_budget else None
+    try:
+        return (ticket_id, *_worker_cleaner.clean_with_entries(text, deadline))
+    except CleaningTimeout:
+        return ticket_id, None, []
+
+def clean_batch(batch):
+    return [clean_ticket(ticket_id, text) for ticket_id, text in batch]
+
+# Cleans batches of (ticket_id, text) tuples into (ticket_id, cleaned_text, entries) tuples, with workers > 1
+# in a process pool. The cleaned batches are yielded in the order of the input batches, so the output does
+# not depend on the number of workers.
+def clean_batches(batches, keywords, specific_terms, boilerplate=(), workers=1, time_budget=None):
+    if workers <= 1:
+        init_worker(keywords, specific_terms, boilerplate, time_budget)
+        for batch in batches:
+            yield clean_batch(batch)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(keywords, specific_terms, boilerplate, time_budget)) as executor:
+        in_flight = deque()
+        for batch in batches:
+            in_flight.append(executor.submit(clean_batch, batch))
+            # Bounded read ahead, the producer stays at most two batches per worker ahead of the writer
+            if len(in_flight) >= 2 * workers:
+                yield in_flight.popleft().result()
+        while in_flight:
+            yield in_flight.popleft().result()
@@ -1,55 +1,32 @@
 import json
-import mysql.connector
+import os
+import sys
 from mysql.connector import Error
 import logging
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from database import Database
+
 class DB:
     def __init__(self, config):
-        self.user = config.get('db-user')
-        self.password = config.get('db-password')
-        self.host = config.get('db-host')
-        self.database = config.get('db-database')
-        
         # Connect to the database
-        self.connection = mysql.connector.connect(
-                host=self.host,
-                database=self.database,
-                user=self.user,
-                password=self.password
-            )
+        self.database = Database(config)
 
-        if self.connection.is_connected():
+        if self.database.is_connected():
             print("Connection to the database was successful.")
         else:
             print("Failed to connect to the database.")
         
     def __del__(self):
-        if self.connection.is_connected():
-            cursor = self.connection.cursor()
-            cursor.close()
-            self.connection.close()
-            print("Connection to the database was successfully closed.")
-        else:
-            print("Failed to close to the database connection.")
+        self.database.release()
+        print("Connection to the database was successfully returned to the pool.")
 
     def get_summary_data(self):
         try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
-                query = "SELECT id, question, answer FROM tickets_summary;"
-                cursor.execute(query)
-                rows = cursor.fetchall()
-                
-                column_names = [i[0] for i in cursor.description]
-                df = pd.DataFrame(rows, columns=column_names)
-                
-                cursor.close()
-                
-                return df
-            else:
-                print("Failed to connect to the database.")
-                return None
+            query = "SELECT id, question, answer FROM tickets_summary;"
+            rows, column_names = self.database.fetch_all_with_columns(query)
+            return pd.DataFrame(rows, columns=column_names)
         except Error as e:
             print(f"Error: {e}")
             return None
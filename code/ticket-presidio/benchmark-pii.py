@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import random
+import re
+import time
+import timeit
+import spacy
+from ner_pipeline import MODEL, load_ner_pipeline, person_entities, redact_names, _names_pattern
+
+# Cleaned ticket texts of the golden corpus of the text cleaner, the input clean-pii.py sees
+DEFAULT_TEXTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'ticket-prep', 'golden-corpus.json')
+
+def load_texts(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    # Golden corpus or a plain list of texts
+    if isinstance(data, dict):
+        return [case['expected'] for case in data['cases'] if case['expected']]
+    return data
+
+FIRST_NAMES = ["Anna", "Bernd", "Carla", "Dieter", "Eva", "Frank", "Gisela", "Hans", "Ines", "Jens", "Karin", "Lars", "Monika", "Norbert", "Olga", "Peter"]
+LAST_NAMES = ["Müller", "Schmidt", "Schneider", "Fischer", "Weber", "Meyer", "Wagner", "Becker", "Schulz", "Hoffmann", "Koch", "Richter"]
+MESSAGE_BODY = "Der Drucker im 2. OG druckt seit dem Update nur leere Seiten, bitte prüfen Sie den Treiber.\n"
+
+# Email chain with every previous message quoted below the reply, as tickets from the mail
+# channel look like. Returns the text and the set of names in it.
+def email_chain(names, messages):
+    text = ""
+    for index in range(messages):
+        sender, recipient = random.sample(names, 2)
+        message = f"Von: {sender}\nAn: {recipient}\nBetreff: AW: Drucker ({index})\n\nHallo {recipient},\n{MESSAGE_BODY * 3}Gruss\n{sender}\n"
+        text = message + "\n> ".join([""] + text.split("\n")) if text else message
+    return text
+
+# Previous anonymize_pii: one replace over the whole text per name
+def legacy_redact(text, names):
+    for name in names:
+        text = text.replace(name, "")
+    return text
+
+def clear_pattern_caches():
+    _names_pattern.cache_clear()
+    re.purge()
+
+# Times the redaction on email chains with --names names each, the previous loop and redact_names
+# must give the same texts
+def bench_redaction(args):
+    random.seed(1)
+    all_names = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+    tickets = []
+    for _ in range(args.chains):
+        names = random.sample(all_names, args.names)
+        tickets.append((email_chain(names, args.messages), set(names)))
+    print(f"{len(tickets)} email chains, {args.messages} messages and {args.names} names each, {sum(len(text) for text, _ in tickets) // len(tickets)} characters on average")
+
+    if any(legacy_redact(text, names) != redact_names(text, names) for text, names in tickets):
+        raise SystemExit("redact_names removes other text than the previous replace loop")
+
+    # Cold: the compiled patterns of the names are not cached yet, as for names that occur in one ticket only
+    runs = (("replace per name", legacy_redact, None), ("redact_names, cold pattern cache", redact_names, clear_pattern_caches),
+            ("redact_names, cached patterns", redact_names, None))
+    for label, function, setup in runs:
+        seconds = min(timeit.repeat(lambda: [function(text, names) for text, names in tickets], setup=setup or "pass", number=1, repeat=args.repeat))
+        print(f"{label:<40} {seconds * 1000:8.2f} ms  ({len(tickets) / seconds:8.1f} docs/s)")
+
+def report(label, seconds, count):
+    print(f"{label:<40} {seconds:8.2f} s  ({count / seconds:8.1f} docs/s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the previous per ticket nlp(text) of clean-pii.py with nlp.pipe on the NER only pipeline.")
+    parser.add_argument("--texts", default=DEFAULT_TEXTS, help="json with a list of texts or a golden corpus (default: golden corpus of ticket-prep)")
+    parser.add_argument("--copies", type=int, default=20, help="number of copies of the texts that are processed")
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--processes", default="1,2,4,8", help="n_process values of nlp.pipe")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--redaction", action="store_true", help="time the name redaction on long email chains instead of the NER (no model needed)")
+    parser.add_argument("--chains", type=int, default=200, help="number of email chains of --redaction")
+    parser.add_argument("--messages", type=int, default=20, help="messages per email chain")
+    parser.add_argument("--names", type=int, default=40, help="person names per email chain")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.redaction:
+        bench_redaction(args)
+        raise SystemExit
+
+    texts = load_texts(args.texts) * args.copies
+    print(f"{len(texts)} texts, {sum(len(text) for text in texts)} characters, model {args.model}")
+
+    # Previous clean-pii.py: every component of the model, one nlp call per ticket
+    full = spacy.load(args.model)
+    start = time.perf_counter()
+    expected = [person_entities(full(text)) for text in texts]
+    baseline = time.perf_counter() - start
+    report(f"nlp(text), {len(full.pipe_names)} components", baseline, len(texts))
+
+    nlp = load_ner_pipeline(args.model)
+    print(f"Enabled components: {', '.join(nlp.pipe_names)}")
+
+    # The person names have to be the ones of the full pipeline before the timings mean anything
+    failures = 0
+    for processes in [int(value) for value in args.processes.split(',')]:
+        start = time.perf_counter()
+        names = [person_entities(doc) for doc in nlp.pipe(texts, batch_size=args.batch_size, n_process=processes)]
+        seconds = time.perf_counter() - start
+        report(f"nlp.pipe, n_process={processes}", seconds, len(texts))
+        print(f"{'':<40} speedup {baseline / seconds:.2f}x")
+        if names != expected:
+            failures += 1
+            print(f"Person names with n_process={processes} differ from the full pipeline in {sum(a != b for a, b in zip(names, expected))} texts")
+
+    if failures:
+        raise SystemExit(f"{failures} runs with different person names")
@@ -1,12 +1,23 @@
 import logging
 import json
-import pandas as pd
-import mysql.connector
+import hashlib
+import os
+import sys
 from mysql.connector import Error
-import spacy
 import re
+import argparse
+from collections import Counter
 
-nlp = spacy.load("de_core_news_lg")
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from database import Database
+from pipeline import iter_pending_ids, count_pending_ids, mark_downstream_stale, read_state, update_state, CLEAR_STALE_QUERY
+from ner_pipeline import load_ner_pipeline, model_version, person_entities, redact_names, Gazetteer
+
+# Only the components the entity recognizer needs
+nlp = load_ner_pipeline()
+
+# Length of pii_names.name, longer names are stored by their prefix
+NAME_LENGTH = 255
 
 name_regex = re.compile(r'\b(?:[A-ZÄÖÜ][a-zäöüß]+(?:[-\' ][A-ZÄÖÜ][a-zäöüß]+)?)+\b')
 
@@ -18,23 +29,37 @@ def is_valid_name(name):
 def is_discardable_name(name):
     return bool(discard_patterns.search(name))
 
-def anonymize_pii(text, config):
-    doc = nlp(text)
-    anonymized_text = text
-    
+# Only names matching name_regex are removed, a text without such a word needs no NER
+def has_name_candidate(text):
+    return bool(name_regex.search(text))
+
+# Fingerprint of the rules that filter the NER results. After a change all tickets are filtered again,
+# the entities of unchanged texts come from pii_entities.
+def filter_version(config):
+    rules = {
+        "false_recognized_names": sorted(config.get("false_recognized_names", [])),
+        "name_regex": name_regex.pattern,
+        "discard_patterns": discard_patterns.pattern,
+    }
+    return hashlib.sha256(json.dumps(rules, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+# Removes the person names among the entities the NER found in text. The detected names are counted
+# in names ({(name, kind): tickets}), which is merged into pii_names.
+def anonymize_entities(text, entities, config, names=None):
     person_names = set()
     discarded_names = set()
     false_recognized_names = set(config.get("false_recognized_names", []))
 
-    for ent in doc.ents:
-        if ent.label_ == "PER":
-            name = ent.text
-            if is_discardable_name(name) or name in false_recognized_names:
-                discarded_names.add(name)
-            elif is_valid_name(name):
-                person_names.add(name)
-            else:
-                discarded_names.add(name)
+    for name in entities:
+        if is_discardable_name(name) or name in false_recognized_names:
+            discarded_names.add(name)
+        elif is_valid_name(name):
+            person_names.add(name)
+        else:
+            discarded_names.add(name)
 
     if person_names:
         print("Detected valid person names:")
@@ -46,124 +71,208 @@ def anonymize_pii(text, config):
         for name in discarded_names:
             print(f"- {name}")
 
-    # Replace valid person names with placeholders in the text
-    for name in person_names:
-        anonymized_text = anonymized_text.replace(name, "")
+    # Remove every occurrence of the valid person names, not only the recognized ones
+    anonymized_text = redact_names(text, person_names)
 
-    config.setdefault("valid_names", []).extend(person_names)
-    config.setdefault("discarded_names", []).extend(discarded_names)
-    config["valid_names"] = list(set(config["valid_names"]))
-    config["discarded_names"] = list(set(config["discarded_names"]))
+    if names is not None:
+        names.update((name[:NAME_LENGTH], 'valid') for name in person_names)
+        names.update((name[:NAME_LENGTH], 'discarded') for name in discarded_names)
 
     return anonymized_text
 
-def update_config_file(config, file_path):
-    with open(file_path, 'w') as file:
-        json.dump(config, file, indent=4)
-
 class DB:
     def __init__(self, config):
-        self.user = config.get('db-user')
-        self.password = config.get('db-password')
-        self.host = config.get('db-host')
-        self.database = config.get('db-database')
-        self.connection = mysql.connector.connect(
-            host=self.host,
-            database=self.database,
-            user=self.user,
-            password=self.password
-        )
+        self.database = Database(config)
 
     def __del__(self):
-        if self.connection.is_connected():
-            cursor = self.connection.cursor()
-            cursor.close()
-            self.connection.close()
+        self.database.release()
+
+    # Reads the texts of a block of tickets with one query, returns {ticket_id: (text, previous cleaned text)}
+    def read_tickets(self, ticket_ids):
+        query = "SELECT t.id, t.text, c.text FROM tickets_texts t LEFT JOIN tickets_texts_cleaned c ON c.id = t.id WHERE t.id IN ({ids});"
+        try:
+            return {ticket_id: (text, previous) for ticket_id, text, previous in self.database.fetch_by_ids(query, ticket_ids)}
+        except Error as e:
+            print(f"Error: {e}")
+            return {}
 
-    def check_ticket_exists_in_tickets_texts_cleaned(self, ticket_id):
+    # Upserts a batch of (ticket_id, cleaned_text) rows with one executemany, stale tickets already have a row.
+    # Downstream rows of the changed tickets become stale, the NER results go to pii_entities.
+    def insert_cleaned_texts(self, rows, changed_ids=(), entities=()):
+        if not rows:
+            return
         try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
-                query = "SELECT COUNT(*) FROM tickets_texts_cleaned WHERE id = %s;"
-                cursor.execute(query, (ticket_id,))
-                counter = cursor.fetchone()[0]
-                return counter == 1
+            with self.database.transaction() as cursor:
+                query = "INSERT INTO tickets_texts_cleaned (id, text) VALUES (%s, %s) ON DUPLICATE KEY UPDATE text = VALUES(text);"
+                cursor.executemany(query, rows)
+                cursor.executemany(CLEAR_STALE_QUERY, [(ticket_id, 'tickets_texts_cleaned') for ticket_id, _ in rows])
+                mark_downstream_stale(cursor, 'tickets_texts_cleaned', changed_ids)
+                if entities:
+                    query = "INSERT INTO pii_entities (text_hash, model, entities) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE entities = VALUES(entities);"
+                    cursor.executemany(query, entities)
+            print(f"Inserted cleaned text for {len(rows)} tickets.")
         except Error as e:
             print(f"Error: {e}")
-        finally:
-            if self.connection.is_connected():
-                cursor.close()
 
-    def get_tickets_counter(self):
+    # Cached person entities of the texts, returns {text_hash: [entity text]}
+    def read_cached_entities(self, text_hashes, model):
+        query = "SELECT text_hash, model, entities FROM pii_entities WHERE text_hash IN ({ids});"
         try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
-                query = "SELECT COUNT(*) FROM tickets_texts;"
-                cursor.execute(query)
-                counter = cursor.fetchone()[0]
-                return int(counter)
+            return {key: json.loads(entities) for key, version, entities in self.database.fetch_by_ids(query, text_hashes) if version == model}
         except Error as e:
             print(f"Error: {e}")
-        finally:
-            if self.connection.is_connected():
-                cursor.close()
-
-    def read_ticket(self, ticket_id):
-        if self.connection is None:
-            return None
-        query = "SELECT id, text FROM tickets_texts WHERE id = %s;"
+            return {}
+
+    # Marks every cleaned text stale, they are filtered again on this run
+    def mark_all_stale(self):
+        query = "INSERT IGNORE INTO tickets_stale (id, stage) SELECT id, 'tickets_texts_cleaned' FROM tickets_texts_cleaned;"
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, (ticket_id,))
-            rows = cursor.fetchall()
-            column_names = [i[0] for i in cursor.description]
-            df = pd.DataFrame(rows, columns=column_names)
-            cursor.close()
-            return df
+            self.database.execute(query)
         except Error as e:
             print(f"Error: {e}")
-            return None
 
-    def insert_cleaned_text(self, ticket_id, cleaned_text):
+    def read_state(self, name):
         try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
+            return read_state(self.database, name)
+        except Error as e:
+            print(f"Error: {e}")
+        return None
 
-                query = "INSERT INTO tickets_texts_cleaned (id, text) VALUES (%s, %s);"
-                cursor.execute(query, (ticket_id, cleaned_text))
-                self.connection.commit()
-                print(f"Inserted cleaned text for ticket ID {ticket_id}.")
+    def update_state(self, name, value):
+        try:
+            update_state(self.database, name, value)
+        except Error as e:
+            print(f"Error: {e}")
+
+    # Valid names found in at least min_tickets tickets, the names the gazetteer removes without NER
+    def read_known_names(self, min_tickets):
+        query = "SELECT name FROM pii_names WHERE kind = 'valid' AND tickets >= %s;"
+        try:
+            return {name for name, in self.database.fetch_all(query, (min_tickets,))}
+        except Error as e:
+            print(f"Error: {e}")
+            return set()
+
+    # Merges {(name, kind): tickets} into pii_names. Every run only adds to the counters, parallel runs
+    # do not overwrite each other.
+    def record_names(self, names):
+        if not names:
+            return
+        query = "INSERT INTO pii_names (name, kind, tickets) VALUES (%s, %s, %s) ON DUPLICATE KEY UPDATE tickets = tickets + VALUES(tickets);"
+        try:
+            with self.database.transaction() as cursor:
+                # Sorted, so concurrent runs lock the rows in the same order
+                cursor.executemany(query, [(name, kind, count) for (name, kind), count in sorted(names.items())])
         except Error as e:
             print(f"Error: {e}")
-        finally:
-            if self.connection.is_connected():
-                cursor.close()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
 
+    parser = argparse.ArgumentParser(description="Remove the person names of the pending tickets into tickets_texts_cleaned.")
+    parser.add_argument("--workers", type=int, help="number of spaCy processes (default: pii-workers of config.json or 1)")
+    args = parser.parse_args()
+
     config_file_path = 'config.json'
     with open(config_file_path, 'r') as file:
         config = json.load(file)
 
     db = DB(config)
 
-    ticket_id = 11851846 # 01.06.2024
-
-    ticket_counter = db.get_tickets_counter()
-    print(f"Rows: {ticket_counter}")
-
-    for counter in range(ticket_counter):
-        if not db.check_ticket_exists_in_tickets_texts_cleaned(ticket_id):
-            ticket_df = db.read_ticket(ticket_id)
-            if ticket_df is not None and not ticket_df.empty:
-                raw_text = ticket_df.loc[0, 'text']
-                cleaned_text = anonymize_pii(raw_text, config)
-                db.insert_cleaned_text(ticket_id, cleaned_text)
-                update_config_file(config, config_file_path)
-            else:
-                print(f"No data found for ticket ID {ticket_id}.")
-        else:
-            print(f"Ticket ID {ticket_id} already exists in tickets_texts_cleaned.")
+    chunk_size = config.get('db-chunk-size', 500)
+    batch_size = config.get('pii-batch-size', 64)
+    workers = args.workers or config.get('pii-workers', 1)
+
+    # A change of the filter rules cleans all tickets again, without NER for unchanged texts
+    version = filter_version(config)
+    previous_version = db.read_state('pii-filter-version')
+    if previous_version is not None and previous_version != version:
+        print("Filter rules changed, all tickets are filtered again.")
+        db.mark_all_stale()
+    if previous_version != version:
+        db.update_state('pii-filter-version', version)
+
+    print(f"Pending tickets: {count_pending_ids(db.database, 'tickets_texts_cleaned')}")
+
+    # Name lists of earlier runs were kept in config.json, they move to pii_names once
+    previous_names = Counter()
+    for kind in ('valid', 'discarded'):
+        previous_names.update((name[:NAME_LENGTH], kind) for name in set(config.get(f"{kind}_names", [])))
+    if previous_names:
+        db.record_names(previous_names)
+        for kind in ('valid', 'discarded'):
+            config.pop(f"{kind}_names", None)
+        with open(config_file_path, 'w') as file:
+            json.dump(config, file, indent=4)
+        print(f"Moved {len(previous_names)} names from {config_file_path} to pii_names.")
+
+    # Known names are removed before the NER, tickets without another name candidate left skip it
+    false_recognized_names = set(config.get("false_recognized_names", []))
+    known_names = {name for name in db.read_known_names(config.get('pii-gazetteer-min-tickets', 2)) if is_valid_name(name) and name not in false_recognized_names}
+    gazetteer = Gazetteer(nlp, known_names)
+    print(f"Gazetteer: {gazetteer.size} known names")
+
+    model = model_version(nlp)
+    rows = []
+    changed_ids = []
+    entities = []
+    names = Counter()
+    counts = Counter()
+    previous_texts = {}
+
+    def flush():
+        db.insert_cleaned_texts(rows, changed_ids, entities)
+        db.record_names(names)
+        rows.clear()
+        changed_ids.clear()
+        entities.clear()
+        names.clear()
+
+    def add_row(ticket_id, cleaned_text):
+        rows.append((ticket_id, cleaned_text))
+        previous = previous_texts.pop(ticket_id, None)
+        if previous is not None and previous != cleaned_text:
+            changed_ids.append(ticket_id)
+        if len(rows) >= batch_size:
+            flush()
+
+    # Producer: (text, (ticket_id, text_hash)) of the pending tickets that still need the NER, read chunk
+    # by chunk. Tickets that skip it or have cached entities are written from here.
+    def iter_texts():
+        for ticket_ids in iter_pending_ids(db.database, 'tickets_texts_cleaned', chunk_size):
+            tickets = db.read_tickets(ticket_ids)
+            hashes = {ticket_id: text_hash(text) for ticket_id, (text, _) in tickets.items() if text is not None}
+            cached = db.read_cached_entities(set(hashes.values()), model)
+            for ticket_id in ticket_ids:
+                if ticket_id not in hashes:
+                    print(f"No data found for ticket ID {ticket_id}.")
+                    continue
+                text, previous = tickets[ticket_id]
+                if previous is not None:
+                    previous_texts[ticket_id] = previous
+                counts['tickets'] += 1
+                found = gazetteer.find(text)
+                if found:
+                    text = redact_names(text, found)
+                    names.update((name, 'valid') for name in found)
+                if hashes[ticket_id] in cached:
+                    counts['cached'] += 1
+                    ticket_entities = [name for name in cached[hashes[ticket_id]] if name not in found]
+                    add_row(ticket_id, anonymize_entities(text, ticket_entities, config, names))
+                elif has_name_candidate(text):
+                    yield text, (ticket_id, hashes[ticket_id])
+                else:
+                    counts['skipped'] += 1
+                    add_row(ticket_id, text)
+
+    # One nlp.pipe over the tickets that need the NER, the worker processes start once. Results, the
+    # entities and the detected names are written once per batch.
+    for doc, (ticket_id, key) in nlp.pipe(iter_texts(), as_tuples=True, batch_size=batch_size, n_process=workers):
+        ticket_entities = person_entities(doc)
+        entities.append((key, model, json.dumps(ticket_entities, ensure_ascii=False)))
+        add_row(ticket_id, anonymize_entities(doc.text, ticket_entities, config, names))
+    flush()
 
-        ticket_id = ticket_id - 1
+    if counts['tickets']:
+        print(f"NER skipped for {counts['skipped']} of {counts['tickets']} tickets without name candidates ({100 * counts['skipped'] / counts['tickets']:.1f}%), "
+              f"cached entities used for {counts['cached']} ({100 * counts['cached'] / counts['tickets']:.1f}%)")
@@ -0,0 +1,78 @@
+import re
+from functools import lru_cache
+import spacy
+from spacy.matcher import PhraseMatcher
+
+# Model of clean-pii.py, German pipeline with tok2vec, tagger, morphologizer, parser, lemmatizer,
+# attribute_ruler and ner
+MODEL = "de_core_news_lg"
+
+# Loads the model with every component disabled that the entity recognizer does not need (parser,
+# lemmatizer, morphologizer, attribute_ruler, tagger). The shared tok2vec stays enabled only if ner
+# listens to it, the ner of the core pipelines has an embedding layer of its own.
+def load_ner_pipeline(model=MODEL):
+    nlp = spacy.load(model)
+    needed = {"ner"}
+    if "tok2vec" in nlp.pipe_names and "ner" in getattr(nlp.get_pipe("tok2vec"), "listening_components", []):
+        needed.add("tok2vec")
+    nlp.select_pipes(disable=[name for name in nlp.pipe_names if name not in needed])
+    return nlp
+
+# Version of the model and of spaCy, entities cached with another version are not used
+def model_version(nlp):
+    return f"{nlp.meta['lang']}_{nlp.meta['name']}-{nlp.meta['version']}/spacy-{spacy.__version__}"
+
+# Person names of a processed text, as clean-pii.py checks them
+def person_entities(doc):
+    return [ent.text for ent in doc.ents if ent.label_ == "PER"]
+
+# Known person names of earlier runs, found with one PhraseMatcher pass over the tokens of a text.
+# Only the tokenizer of the pipeline runs, not the model.
+class Gazetteer:
+    def __init__(self, nlp, names):
+        self.tokenizer = nlp.tokenizer
+        self.matcher = PhraseMatcher(nlp.vocab)
+        self.size = len(names)
+        if names:
+            self.matcher.add("PER", list(self.tokenizer.pipe(sorted(names))))
+
+    def find(self, text):
+        if not self.size:
+            return set()
+        doc = self.tokenizer(text)
+        return {doc[start:end].text for _, start, end in self.matcher(doc)}
+
+# Alternation of the names, longest first so the longest name matches at every position.
+# Names that occur in many tickets (gazetteer) reuse their compiled pattern.
+@lru_cache(maxsize=1024)
+def _names_pattern(names):
+    return re.compile("|".join(re.escape(name) for name in sorted(names, key=len, reverse=True)))
+
+# Removes every occurrence of the names from text. The occurrences are collected in one scan of the
+# text and the text is rebuilt once without the characters any of them covers. The scan continues one
+# character after the start of every match, so overlapping names ("Gruss Max" and "Max Mustermann"
+# in "Gruss Max Mustermann") are removed completely whatever the order of the set is.
+def redact_names(text, names):
+    names = frozenset(name for name in names if name)
+    if not names:
+        return text
+    if len(names) == 1:
+        name, = names
+        return text.replace(name, "")
+    pattern = _names_pattern(names)
+    spans = []
+    match = pattern.search(text)
+    while match:
+        spans.append(match.span())
+        match = pattern.search(text, match.start() + 1)
+    if not spans:
+        return text
+    spans.sort()
+    pieces = []
+    end = 0
+    for start, stop in spans:
+        if start > end:
+            pieces.append(text[end:start])
+        end = max(end, stop)
+    pieces.append(text[end:])
+    return "".join(pieces)
@@ -1,7 +1,13 @@
-import mysql.connector
+import os
+import sys
 from mysql.connector import Error, IntegrityError
 import json
 import logging
+from itertools import chain
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from database import Database
+from pipeline import iter_ticket_ids
 
 class DB:
     def __init__(self, config_path):
@@ -9,49 +15,26 @@ class DB:
         with open(config_path, 'r') as file:
             self.config = json.load(file)
 
-        self.user = self.config.get('db-user')
-        self.password = self.config.get('db-password')
-        self.host = self.config.get('db-host')
-        self.database = self.config.get('db-database')
         self.keywords = self.config.get('keywords', [])
 
         # Connect to the database
-        self.connection = mysql.connector.connect(
-            host=self.host,
-            database=self.database,
-            user=self.user,
-            password=self.password
-        )
-
-        if self.connection.is_connected():
+        self.database = Database(self.config)
+
+        if self.database.is_connected():
             print("Connection to the database was successful.")
         else:
             print("Failed to connect to the database.")
         
     def __del__(self):
-        if self.connection.is_connected():
-            cursor = self.connection.cursor()
-            cursor.close()
-            self.connection.close()
-            print("Connection to the database was successfully closed.")
-        else:
-            print("Failed to close the database connection.")
+        self.database.release()
+        print("Connection to the database was successfully returned to the pool.")
 
     def get_tickets_counter(self):
         try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
-                query = "SELECT COUNT(*) FROM tickets;"
-                cursor.execute(query)
-                counter = cursor.fetchone()[0]
-                return int(counter)
-            else:
-                print("Failed to connect to the database.")
+            counter = self.database.fetch_one("SELECT COUNT(*) FROM tickets_summary;")[0]
+            return int(counter)
         except Error as e:
             print(f"Error: {e}")
-        finally:
-            if self.connection.is_connected():
-                cursor.close()
 
     def read_ticket(self, ticket_id):
         query = "SELECT id, text FROM tickets WHERE id = %s;"
@@ -70,32 +53,17 @@ class DB:
         return self._execute_query_single_result(query, (ticket_id,))
 
     def update_ticket_summary(self, ticket_id, new_question, new_answer):
-        if self.connection is None:
-            print("No connection to the database.")
-            return None
-
         query = "UPDATE tickets_summary SET question = %s, answer = %s WHERE id = %s;"
         
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, (new_question, new_answer, ticket_id))
-            self.connection.commit()
-            cursor.close()
+            self.database.execute(query, (new_question, new_answer, ticket_id))
             print(f"Ticket summary {ticket_id} updated successfully.")
         except Error as e:
             print(f"Error: {e}")
 
     def _execute_query_single_result(self, query, params):
-        if self.connection is None:
-            print("No connection to the database.")
-            return None
-        
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, params)
-            row = cursor.fetchone()
-            cursor.close()
-            return row
+            return self.database.fetch_one(query, params)
         except Error as e:
             print(f"Error: {e}")
             return None
@@ -119,11 +87,11 @@ class DB:
 
     def iterate_and_update_summaries(self):
         ticket_counter = self.get_tickets_counter()
-        print(f"Total Tickets: {ticket_counter}")
-
-        ticket_id = 11851846 # 01.06.2024
+        print(f"Summarized Tickets: {ticket_counter}")
 
-        for _ in range(ticket_counter):
+        # Only tickets with a summary can be reviewed
+        ticket_ids = chain.from_iterable(iter_ticket_ids(self.database, 'tickets_summary', self.config.get('db-chunk-size', 500)))
+        for ticket_id in ticket_ids:
             # Stage 1: Read the ticket
             ticket = self.read_ticket(ticket_id)
             if ticket:
@@ -175,8 +143,6 @@ class DB:
                             print("Invalid choice. Please select 1, 2, 3, or 4.")
             else:
                 print(f"Ticket with ID {ticket_id} not found.")
-            
-            ticket_id -= 1
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)
@@ -0,0 +1,115 @@
+import argparse
+import glob
+import os
+import timeit
+from lxml import etree
+from odata_parser import PROPERTY_NAMES, parse_entry_document, iter_feed_entries
+
+namespaces = {
+    'atom': 'http://www.w3.org/2005/Atom',
+    'd': 'http://schemas.microsoft.com/ado/2007/08/dataservices',
+    'm': 'http://schemas.microsoft.com/ado/2007/08/dataservices/metadata'
+}
+
+# Previous Api.read parser: one find() per property, each re-walking atom:content/m:properties
+def legacy_get_text(element):
+    return element.text.strip() if element is not None and element.text else None
+
+def legacy_parse_entry(root):
+    return {
+        'id': legacy_get_text(root.find('atom:id', namespaces)),
+        'title': legacy_get_text(root.find('atom:title', namespaces)),
+        'updated': legacy_get_text(root.find('atom:updated', namespaces)),
+        'category': {
+            'scheme': root.find('atom:category', namespaces).attrib.get('scheme'),
+            'term': root.find('atom:category', namespaces).attrib.get('term')
+        },
+        'links': [
+            {
+                'href': link.attrib.get('href'),
+                'rel': link.attrib.get('rel'),
+                'title': link.attrib.get('title'),
+                'type': link.attrib.get('type')
+            }
+            for link in root.findall('atom:link', namespaces)
+        ],
+        'properties': {
+            name: legacy_get_text(root.find(f'atom:content/m:properties/d:{name}', namespaces))
+            for name in PROPERTY_NAMES
+        }
+    }
+
+def legacy_parse_entry_document(content):
+    parser = etree.XMLParser(recover=True)
+    return legacy_parse_entry(etree.fromstring(content, parser=parser))
+
+def legacy_parse_feed(content):
+    parser = etree.XMLParser(recover=True)
+    root = etree.fromstring(content, parser=parser)
+    return [legacy_parse_entry(entry) for entry in root.findall('atom:entry', namespaces)]
+
+# Synthetic entry in the shape of the ticket api responses, used when no recorded responses are given
+def synthetic_entry(ticket_id, namespace_declarations=True):
+    declarations = ' xmlns="http://www.w3.org/2005/Atom" xmlns:m="{m}" xmlns:d="{d}"'.format(**namespaces) if namespace_declarations else ''
+    text = "Sehr geehrte Damen und Herren,\nder Server antwortet nicht.\n" * 40
+    properties = ''.join(
+        f'<d:{name} m:null="true"/>' if name == 'psp' else f'<d:{name}>{ticket_id if name == "id" else text if name == "text" else name}</d:{name}>'
+        for name in PROPERTY_NAMES
+    )
+    return (
+        f'<entry{declarations}><id>https://ticket-system/TicketSet({ticket_id})</id>'
+        f'<title type="text">TicketSet({ticket_id})</title><updated>2024-06-01T10:00:00Z</updated>'
+        f'<category term="ZTICKET.Ticket" scheme="http://schemas.microsoft.com/ado/2007/08/dataservices/scheme"/>'
+        f'<link href="TicketSet({ticket_id})" rel="edit" title="Ticket"/>'
+        f'<content type="application/xml"><m:properties>{properties}</m:properties></content></entry>'
+    )
+
+def synthetic_feed(ticket_ids):
+    return (
+        '<feed xmlns="http://www.w3.org/2005/Atom" xmlns:m="{m}" xmlns:d="{d}"><id>TicketSet</id>'.format(**namespaces)
+        + ''.join(synthetic_entry(ticket_id, namespace_declarations=False) for ticket_id in ticket_ids)
+        + '</feed>'
+    ).encode('utf-8')
+
+def load_responses(directory):
+    responses = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.xml'))):
+        with open(path, 'rb') as file:
+            responses.append(file.read())
+    return responses
+
+def bench(label, function, payloads, repeat):
+    seconds = min(timeit.repeat(lambda: [function(payload) for payload in payloads], number=1, repeat=repeat))
+    print(f"{label:<40} {seconds * 1000:10.2f} ms  ({len(payloads) / seconds:10.1f} responses/s)")
+    return seconds
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the find() based entry parser with the single-pass odata_parser.")
+    parser.add_argument("--responses", help="directory with recorded single entry responses (*.xml)")
+    parser.add_argument("--entries", type=int, default=500, help="number of synthetic entries if no responses are given")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.responses:
+        entries = load_responses(args.responses)
+        print(f"Loaded {len(entries)} recorded responses from {args.responses}")
+    else:
+        entries = [synthetic_entry(ticket_id).encode('utf-8') for ticket_id in range(args.entries)]
+        print(f"Generated {len(entries)} synthetic responses")
+
+    # Both parsers have to agree before the timings mean anything
+    for content in entries:
+        assert legacy_parse_entry_document(content) == parse_entry_document(content)
+
+    print("\nSingle entry responses (Api.read)")
+    legacy = bench("find() per property", legacy_parse_entry_document, entries, args.repeat)
+    single_pass = bench("odata_parser.parse_entry_document", parse_entry_document, entries, args.repeat)
+    print(f"Speedup: {legacy / single_pass:.2f}x")
+
+    feed = synthetic_feed(range(len(entries)))
+    assert legacy_parse_feed(feed) == list(iter_feed_entries(feed))
+
+    print(f"\nFeed response with {len(entries)} entries (Api.read_range)")
+    legacy = bench("fromstring + findall + find()", legacy_parse_feed, [feed], args.repeat)
+    streaming = bench("odata_parser.iter_feed_entries", lambda content: list(iter_feed_entries(content)), [feed], args.repeat)
+    print(f"Speedup: {legacy / streaming:.2f}x")
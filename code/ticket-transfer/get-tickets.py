@@ -1,11 +1,30 @@
 import xml.etree.ElementTree as ET
-from lxml import etree
 import logging
 import requests
+from requests.adapters import HTTPAdapter
+import hashlib
 import json
-import mysql.connector
+import os
+import sys
 from mysql.connector import Error, IntegrityError
 import time
+import argparse
+from datetime import datetime, timezone
+from urllib.parse import quote, urljoin, urlsplit, urlunsplit
+from harvester import AdaptiveConcurrency, ConcurrentHarvester, ThroughputReporter, GapProber, TicketIdSet, CompletedRanges, iter_blocks
+from odata_parser import PROPERTY_TAGS, parse_entry_document, iter_feed_entries, property_tags
+from response_cache import ResponseCache
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from database import Database
+from pipeline import STAGE_SOURCES, read_state, update_state
+
+class ApiError(Exception):
+    def __init__(self, status_code, message, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        # Response headers, the harvester honors Retry-After of 429/503 responses
+        self.headers = headers or {}
 
 class Api:
     namespaces = {
@@ -15,10 +34,16 @@ class Api:
         'error': 'http://schemas.microsoft.com/ado/2007/08/dataservices/metadata'
     }
 
-    def __init__(self, config):
+    def __init__(self, config, cache=None, pool_size=10):
+        self.cache = cache
+        self.pool_size = pool_size
         self.user = config.get('api-user')
         self.password = config.get('api-password')
         self.path = config.get('api-url')
+        self.feed_path = config.get('api-feed-url')
+        self.updated_property = config.get('api-updated-property', 'updated')
+        # The delta sync also parses the property it filters and orders on
+        self.delta_tags = property_tags((self.updated_property,))
         self.__set_basic_auth()
         self.__set_header()
 
@@ -26,212 +51,634 @@ class Api:
         self.session = requests.Session()
         self.session.auth = (self.user, self.password)
 
+        # One pooled connection per in-flight request of the harvester
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
     def __set_header(self):
         self.session.headers.update({"Content-Type": "application/json"})
         self.session.headers.update({"X-Requested-With": "X"})
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
 
     def __retrun_html_error(self, response):
-        root = ET.fromstring(response.content)
-        message = self._get_text(root.find('error:message', self.namespaces))
+        try:
+            root = ET.fromstring(response.content)
+            message = self._get_text(root.find('error:message', self.namespaces))
+        except ET.ParseError:
+            # Gateways answer 429/5xx with plain html instead of an OData error document
+            message = response.text[:200]
 
-        raise Exception(f"Statuscode: {str(response.status_code)} Content: '{message}' ")
+        raise ApiError(response.status_code, f"Statuscode: {str(response.status_code)} Content: '{message}' ", response.headers)
 
     def _get_text(self,element):
         return element.text.strip() if element is not None and element.text else None
 
-    def read(self, ticket_id):
+    # With revalidate the cached response is only used to send its ETag/Last-Modified,
+    # None is returned if the ticket did not change (304, or a 200 with the cached body) so callers can skip it.
+    def read(self, ticket_id, use_cache=True, revalidate=False):
+        headers = {}
+        meta = None
+        if self.cache is not None and use_cache:
+            if revalidate:
+                meta = self.cache.meta(ticket_id)
+                if meta and meta.get('etag'):
+                    headers["If-None-Match"] = meta['etag']
+                if meta and meta.get('last_modified'):
+                    headers["If-Modified-Since"] = meta['last_modified']
+            else:
+                content = self.cache.get(ticket_id)
+                if content is not None:
+                    return parse_entry_document(content)
+
         request_path = self.path.replace("<ID>",str(ticket_id))
-        response = self.session.get(request_path)
+        response = self.session.get(request_path, headers=headers)
 
-        if response.status_code == 200:
-            parser = etree.XMLParser(recover=True)
-            root = etree.fromstring(response.content, parser=parser)
-
-            parsed_data = {
-                'id': self._get_text(root.find('atom:id', self.namespaces)),
-                'title': self._get_text(root.find('atom:title', self.namespaces)),
-                'updated': self._get_text(root.find('atom:updated', self.namespaces)),
-                'category': {
-                    'scheme': root.find('atom:category', self.namespaces).attrib.get('scheme'),
-                    'term': root.find('atom:category', self.namespaces).attrib.get('term')
-                },
-                'links': [
-                    {
-                        'href': link.attrib.get('href'),
-                        'rel': link.attrib.get('rel'),
-                        'title': link.attrib.get('title'),
-                        'type': link.attrib.get('type')
-                    }
-                    for link in root.findall('atom:link', self.namespaces)
-                ],
-                'properties': {
-                    'sap_ticketstatus': self._get_text(root.find('atom:content/m:properties/d:sap_ticketstatus', self.namespaces)),
-                    'sap_ticketstatus_t': self._get_text(root.find('atom:content/m:properties/d:sap_ticketstatus_t', self.namespaces)),
-                    'sap_ticketno': self._get_text(root.find('atom:content/m:properties/d:sap_ticketno', self.namespaces)),
-                    'cdl_text': self._get_text(root.find('atom:content/m:properties/d:cdl_text', self.namespaces)),
-                    'id': self._get_text(root.find('atom:content/m:properties/d:id', self.namespaces)),
-                    'guid': self._get_text(root.find('atom:content/m:properties/d:guid', self.namespaces)),
-                    'processtype': self._get_text(root.find('atom:content/m:properties/d:processtype', self.namespaces)),
-                    'action': self._get_text(root.find('atom:content/m:properties/d:action', self.namespaces)),
-                    'company': self._get_text(root.find('atom:content/m:properties/d:company', self.namespaces)),
-                    'reporter': self._get_text(root.find('atom:content/m:properties/d:reporter', self.namespaces)),
-                    'supportteam': self._get_text(root.find('atom:content/m:properties/d:supportteam', self.namespaces)),
-                    'editor': self._get_text(root.find('atom:content/m:properties/d:editor', self.namespaces)),
-                    'status': self._get_text(root.find('atom:content/m:properties/d:status', self.namespaces)),
-                    'statustxt': self._get_text(root.find('atom:content/m:properties/d:statustxt', self.namespaces)),
-                    'category': self._get_text(root.find('atom:content/m:properties/d:category', self.namespaces)),
-                    'component': self._get_text(root.find('atom:content/m:properties/d:component', self.namespaces)),
-                    'ibase': self._get_text(root.find('atom:content/m:properties/d:ibase', self.namespaces)),
-                    'sysrole': self._get_text(root.find('atom:content/m:properties/d:sysrole', self.namespaces)),
-                    'priority': self._get_text(root.find('atom:content/m:properties/d:priority', self.namespaces)),
-                    'title': self._get_text(root.find('atom:content/m:properties/d:title', self.namespaces)),
-                    'text': self._get_text(root.find('atom:content/m:properties/d:text', self.namespaces)),
-                    'text2': self._get_text(root.find('atom:content/m:properties/d:text2', self.namespaces)),
-                    'security': self._get_text(root.find('atom:content/m:properties/d:security', self.namespaces)),
-                    'postpuntil': self._get_text(root.find('atom:content/m:properties/d:postpuntil', self.namespaces)),
-                    'linkid': self._get_text(root.find('atom:content/m:properties/d:linkid', self.namespaces)),
-                    'cdlid': self._get_text(root.find('atom:content/m:properties/d:cdlid', self.namespaces)),
-                    'optid': self._get_text(root.find('atom:content/m:properties/d:optid', self.namespaces)),
-                    'psp': self._get_text(root.find('atom:content/m:properties/d:psp', self.namespaces)),
-                    'units': self._get_text(root.find('atom:content/m:properties/d:units', self.namespaces)),
-                    'type': self._get_text(root.find('atom:content/m:properties/d:type', self.namespaces)),
-                }
-            }
+        if response.status_code == 304:
+            return None
+        elif response.status_code == 200:
+            # Servers without validators answer every conditional request with the full body
+            if meta and hashlib.sha256(response.content).hexdigest() == meta['sha256']:
+                self.cache.put(ticket_id, response.content, response.headers.get('ETag'),
+                               response.headers.get('Last-Modified'), meta.get('updated'))
+                return None
+            parsed_data = parse_entry_document(response.content)
+            if self.cache is not None:
+                self.cache.put(ticket_id, response.content, response.headers.get('ETag'),
+                               response.headers.get('Last-Modified'), parsed_data['updated'])
             return parsed_data
         else:
            self.__retrun_html_error(response)
 
+    # URL of the feed (or of a resource below it, e.g. /$count) with the query options added to the
+    # query string of api-feed-url. The $ of the option names stays literal, some services reject %24.
+    def _feed_request_path(self, query, resource=''):
+        parts = urlsplit(self.feed_path)
+        options = '&'.join(f"{key}={quote(value)}" for key, value in query.items())
+        return urlunsplit(parts._replace(path=parts.path + resource, query=f"{parts.query}&{options}" if parts.query else options))
+
+    # Reads one page of the feed, returns the parsed entries and the href of its <link rel="next"> (or None)
+    def _read_page(self, request_path, tags=PROPERTY_TAGS):
+        response = self.session.get(request_path)
+
+        if response.status_code != 200:
+            self.__retrun_html_error(response)
+
+        entries = []
+        next_links = []
+        if self.cache is None:
+            entries.extend(iter_feed_entries(response.content, next_links=next_links, tags=tags))
+        else:
+            for parsed_data, content, etag in iter_feed_entries(response.content, raw=True, next_links=next_links, tags=tags):
+                self.cache.put(parsed_data['properties']['id'], content, etag, None, parsed_data['updated'])
+                entries.append(parsed_data)
+        return entries, next_links[-1] if next_links else None
+
+    # Reads all entries of the OData feed matching odata_filter, page_size entries per request.
+    # The service may return fewer entries than $top (server side limit): a <link rel="next"> of the
+    # feed is followed, without one $skip advances by the entries received until a page is empty.
+    def _read_feed(self, odata_filter, orderby, page_size):
+        query = {
+            '$filter': odata_filter,
+            '$orderby': orderby,
+            '$top': str(page_size)
+        }
+        skip = 0
+        next_link = None
+
+        while True:
+            if next_link is None:
+                query['$skip'] = str(skip)
+                request_path = self._feed_request_path(query)
+            else:
+                request_path = urljoin(request_path, next_link)
+            entries, page_next_link = self._read_page(request_path)
+            yield from entries
+
+            if page_next_link is not None:
+                next_link = page_next_link
+            elif next_link is not None or not entries:
+                # The server side paging ended, or $skip is past the last entry
+                break
+            else:
+                skip += len(entries)
+
+    # Reads all tickets with start_id >= id >= end_id from the OData feed, page_size entries per request
+    def read_range(self, start_id, end_id, page_size=100):
+        low, high = min(start_id, end_id), max(start_id, end_id)
+        return self._read_feed(f"id ge {low} and id le {high}", "id desc", page_size)
+
+    # Number of tickets with start_id >= id >= end_id, without transferring the entries
+    def count_range(self, start_id, end_id):
+        low, high = min(start_id, end_id), max(start_id, end_id)
+        request_path = self._feed_request_path({'$filter': f"id ge {low} and id le {high}"}, '/$count')
+        response = self.session.get(request_path)
+
+        if response.status_code == 200:
+            return int(response.text.strip())
+        else:
+            self.__retrun_html_error(response)
+
+    # Reads all tickets changed at or after since (datetime) from the OData feed. Pages continue after
+    # the (updated, id) of the last entry instead of using $skip: a ticket that changes during the sync
+    # moves to the end of the order and would shift the following entries past a $skip boundary.
+    # The key is read from api-updated-property itself, the property the feed filters and orders on.
+    def read_updated_since(self, since, page_size=100):
+        odata_filter = f"{self.updated_property} ge {odata_datetime(since)}"
+        last_key = None
+
+        while True:
+            query = {
+                '$filter': odata_filter,
+                '$orderby': f"{self.updated_property} asc, id asc",
+                '$top': str(page_size)
+            }
+            entries, _ = self._read_page(self._feed_request_path(query), self.delta_tags)
+            if not entries:
+                break
+            yield from entries
+
+            last = entries[-1]
+            key = (self._updated_of(last), int(last['properties']['id']))
+            if last_key is not None and key <= last_key:
+                raise ApiError(None, f"Delta paging did not advance after ticket {key[1]} (updated {key[0]})")
+            last_key = key
+            updated = odata_datetime(key[0])
+            odata_filter = f"{self.updated_property} gt {updated} or ({self.updated_property} eq {updated} and id gt {key[1]})"
+
+    # Value of api-updated-property of an entry as a naive UTC datetime, the key of the delta paging
+    def _updated_of(self, parsed_data):
+        value = parsed_data['properties'].get(self.updated_property)
+        if value is None:
+            raise ApiError(None, f"Ticket {parsed_data['properties']['id']} has no property {self.updated_property} (api-updated-property)")
+        updated = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if updated.tzinfo is not None:
+            updated = updated.astimezone(timezone.utc).replace(tzinfo=None)
+        return updated
+
+# OData v2 datetime literal, with the fraction of a second only if there is one
+def odata_datetime(value):
+    timestamp = value.strftime('%Y-%m-%dT%H:%M:%S')
+    if value.microsecond:
+        timestamp += f".{value.microsecond:06d}".rstrip('0')
+    return f"datetime'{timestamp}'"
+
+# Column order of the tickets table inserts
+TICKET_COLUMNS = (
+    'id', 'sap_ticketstatus', 'sap_ticketstatus_t', 'sap_ticketno', 'cdl_text', 'guid',
+    'processtype', 'action', 'company', 'reporter', 'supportteam', 'editor',
+    'status', 'statustxt', 'category', 'component', 'ibase', 'sysrole',
+    'priority', 'title', 'text', 'text2', 'security', 'postpuntil',
+    'linkid', 'cdlid', 'optid', 'psp', 'units', 'type'
+)
+
+INSERT_TICKET_QUERY = "INSERT INTO tickets ({}) VALUES ({})".format(
+    ', '.join(TICKET_COLUMNS), ', '.join(['%s'] * len(TICKET_COLUMNS))
+)
+
+# Stages that read the tickets table. Only they are marked stale for changed tickets, each stage marks
+# the stages after it stale itself when the text it writes really changes.
+TICKET_STAGES = [stage for stage, source in STAGE_SOURCES.items() if source == 'tickets']
+
+# Delta sync: existing rows are overwritten with the current state of the ticket
+UPSERT_TICKET_QUERY = INSERT_TICKET_QUERY + " ON DUPLICATE KEY UPDATE " + ', '.join(
+    f"{column} = VALUES({column})" for column in TICKET_COLUMNS if column != 'id'
+)
+
+def ticket_values(properties):
+    return tuple(properties[column] for column in TICKET_COLUMNS)
+
+# Id of a parsed ticket, None if the entry has no numeric d:id
+def ticket_id_of(properties):
+    try:
+        return int(properties['id'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
 class DB:
     def __init__(self, config):
-        self.user = config.get('db-user')
-        self.password = config.get('db-password')
-        self.host = config.get('db-host')
-        self.database = config.get('db-database')
-        
-        # Connect to the database
-        self.connection = mysql.connector.connect(
-                host=self.host,
-                database=self.database,
-                user=self.user,
-                password=self.password
-            )
-
-        if self.connection.is_connected():
+        self.database = Database(config)
+
+        if self.database.is_connected():
             print("Connection to the database was successful.")
         else:
             print("Failed to connect to the database.")
         
     def __del__(self):
-        if self.connection.is_connected():
-            cursor = self.connection.cursor()
-            cursor.close()
-            self.connection.close()
-            print("Connection to the database was successfuly closed.")
-        else:
-            print("Failed to close to the database connection.")
+        self.database.release()
+        print("Connection to the database was successfully returned to the pool.")
 
-        
-    def insert_ticket(self, properties):
+    # With upsert an existing ticket is overwritten ('updated') instead of being reported as duplicate
+    def insert_ticket(self, properties, upsert=False):
         try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
-
-                # Insert query
-                insert_query = """
-                INSERT INTO tickets (
-                    id, sap_ticketstatus, sap_ticketstatus_t, sap_ticketno, cdl_text, guid,
-                    processtype, action, company, reporter, supportteam, editor,
-                    status, statustxt, category, component, ibase, sysrole,
-                    priority, title, text, text2, security, postpuntil,
-                    linkid, cdlid, optid, psp, units, type
-                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                """
-
-                # Tuple of values to insert
-                values = (
-                    properties['id'], properties['sap_ticketstatus'], properties['sap_ticketstatus_t'], properties['sap_ticketno'],
-                    properties['cdl_text'], properties['guid'], properties['processtype'], properties['action'], properties['company'],
-                    properties['reporter'], properties['supportteam'], properties['editor'], properties['status'], properties['statustxt'],
-                    properties['category'], properties['component'], properties['ibase'], properties['sysrole'], properties['priority'],
-                    properties['title'], properties['text'], properties['text2'], properties['security'], properties['postpuntil'],
-                    properties['linkid'], properties['cdlid'], properties['optid'], properties['psp'], properties['units'], properties['type']
-                )
-
-                # Execute the query
-                cursor.execute(insert_query, values)
-                self.connection.commit()
-
-                print("Ticket inserted successfully")
-            else:
-                print("Failed to connect to the database.")
+            # Tuple of values to insert
+            values = ticket_values(properties)
+
+            if upsert:
+                # MySQL reports 1 affected row for an insert, 2 for an update and 0 for an unchanged row
+                if self.database.execute(UPSERT_TICKET_QUERY, values) == 1:
+                    print("Ticket inserted successfully")
+                    return 'inserted'
+                print("Ticket updated successfully")
+                return 'updated'
+
+            # Execute the query
+            self.database.execute(INSERT_TICKET_QUERY, values)
+
+            print("Ticket inserted successfully")
+            return 'inserted'
         except IntegrityError as e:
             if 'PRIMARY' in e.msg:
                 print(f"Ticket already exists: {e.msg}")
+                return 'duplicate'
         except Error as e:
             print(f"Error: {e}")
-        finally:
-            if self.connection.is_connected():
-                cursor.close()
-                #self.connection.close()
-                #print("MySQL connection is closed")
-
-    def check_ticket_exists_in_db(self, ticketid):
+        return 'error'
 
-        try:
-            if self.connection.is_connected():
-                cursor = self.connection.cursor()
+    # Inserts a batch of tickets with one executemany and one commit.
+    # Returns {ticket_id: 'inserted' | 'duplicate' | 'updated' | 'error'} for every row of the batch.
+    # With upsert existing tickets are overwritten ('updated') instead of being skipped.
+    def insert_tickets(self, properties_list, upsert=False):
+        outcomes = {}
+        rows = {}
+        for properties in properties_list:
+            ticket_id = int(properties['id'])
+            if ticket_id in outcomes and not upsert:
+                print(f"Ticket already exists: {ticket_id} (duplicate in batch)")
+                continue
+            outcomes[ticket_id] = 'inserted'
+            rows[ticket_id] = properties
+        rows = list(rows.values())
 
-                query = """
-                SELECT COUNT(*) FROM tickets WHERE id = %s;
-                """
+        if not rows:
+            return outcomes
 
-                # Execute the query
-                cursor.execute(query,(ticket_id,))
-                counter = cursor.fetchone()[0]
+        try:
+            with self.database.transaction() as cursor:
+                # Report duplicates per row, like the IntegrityError branch of insert_ticket
+                placeholders = ', '.join(['%s'] * len(outcomes))
+                cursor.execute(f"SELECT id FROM tickets WHERE id IN ({placeholders});", tuple(outcomes))
+                for (ticket_id,) in cursor.fetchall():
+                    if upsert:
+                        outcomes[ticket_id] = 'updated'
+                    else:
+                        outcomes[ticket_id] = 'duplicate'
+                        print(f"Ticket already exists: {ticket_id}")
 
-                if counter == 1:
-                    return True
+                if upsert:
+                    cursor.executemany(UPSERT_TICKET_QUERY, [ticket_values(properties) for properties in rows])
                 else:
-                    return False
+                    new_rows = [ticket_values(properties) for properties in rows if outcomes[int(properties['id'])] == 'inserted']
+                    if new_rows:
+                        cursor.executemany(INSERT_TICKET_QUERY, new_rows)
+
+            if upsert:
+                updated = sum(1 for outcome in outcomes.values() if outcome == 'updated')
+                print(f"{len(rows) - updated} tickets inserted, {updated} tickets updated successfully")
             else:
-                print("Failed to connect to the database.")
+                print(f"{len(new_rows)} tickets inserted successfully")
+        except IntegrityError as e:
+            # Another writer inserted one of the rows in between, retry row by row to find it
+            print(f"Batch insert failed, retrying row by row: {e.msg}")
+            for properties in rows:
+                outcomes[int(properties['id'])] = self.insert_ticket(properties, upsert)
+        except Error as e:
+            print(f"Error: {e}")
+            for ticket_id in outcomes:
+                outcomes[ticket_id] = 'error'
+
+        return outcomes
+
+    # Loads the ids of all harvested tickets in [low, high] with one query
+    def read_ticket_ids(self, low, high):
+        ticket_ids = TicketIdSet(low, high)
+        try:
+            query = "SELECT id FROM tickets WHERE id BETWEEN %s AND %s;"
+            for (ticket_id,) in self.database.fetch_all(query, (ticket_ids.low, ticket_ids.high)):
+                ticket_ids.add(ticket_id)
+        except Error as e:
+            print(f"Error: {e}")
+        return ticket_ids
+
+    def read_harvested_ranges(self):
+        try:
+            return CompletedRanges(self.database.fetch_all("SELECT start_id, end_id FROM harvest_ranges WHERE kind = 'harvested';"))
+        except Error as e:
+            print(f"Error: {e}")
+        return CompletedRanges()
+
+    # Records a completed range, later runs skip it
+    def insert_harvested_range(self, start_id, end_id):
+        try:
+            self.database.execute("INSERT IGNORE INTO harvest_ranges (start_id, end_id, kind) VALUES (%s, %s, 'harvested');", (start_id, end_id))
+            print(f"Checkpoint: range {start_id} - {end_id} completed")
+        except Error as e:
+            print(f"Error: {e}")
+
+    # Ids in [low, high] that are known not to exist
+    def read_empty_ids(self, low, high):
+        empty_ids = TicketIdSet(low, high)
+        try:
+            query = "SELECT start_id, end_id FROM harvest_ranges WHERE kind = 'empty' AND start_id >= %s AND end_id <= %s;"
+            for start_id, end_id in self.database.fetch_all(query, (empty_ids.low, empty_ids.high)):
+                for ticket_id in range(max(end_id, empty_ids.low), min(start_id, empty_ids.high) + 1):
+                    empty_ids.add(ticket_id)
+        except Error as e:
+            print(f"Error: {e}")
+        return empty_ids
+
+    def insert_empty_ranges(self, ranges):
+        if not ranges:
+            return
+        try:
+            query = "INSERT IGNORE INTO harvest_ranges (start_id, end_id, kind) VALUES (%s, %s, 'empty');"
+            self.database.execute_many(query, ranges)
+            print(f"Recorded {len(ranges)} empty ranges")
+        except Error as e:
+            print(f"Error: {e}")
+
+    def update_state(self, name, value):
+        try:
+            update_state(self.database, name, value)
+        except Error as e:
+            print(f"Error: {e}")
+
+    # Marks the existing rows of the downstream stages stale for the given (changed) tickets
+    def mark_stages_stale(self, ticket_ids):
+        if not ticket_ids:
+            return True
+        try:
+            with self.database.transaction() as cursor:
+                placeholders = ', '.join(['%s'] * len(ticket_ids))
+                for stage in TICKET_STAGES:
+                    query = f"INSERT IGNORE INTO tickets_stale (id, stage) SELECT id, %s FROM {stage} WHERE id IN ({placeholders});"
+                    cursor.execute(query, (stage, *ticket_ids))
+                    print(f"Marked {cursor.rowcount} rows of {stage} stale")
+            return True
         except Error as e:
             print(f"Error: {e}")
-        finally:
-            if self.connection.is_connected():
-                cursor.close()
-                #self.connection.close()
-                #print("MySQL connection is closed")
+        return False
+
+    def read_state(self, name):
+        try:
+            return read_state(self.database, name)
+        except Error as e:
+            print(f"Error: {e}")
+        return None
+
+    def check_ticket_exists_in_db(self, ticketid):
+        try:
+            counter = self.database.fetch_one("SELECT COUNT(*) FROM tickets WHERE id = %s;", (ticketid,))[0]
+            return counter == 1
+        except Error as e:
+            print(f"Error: {e}")
+
+class TicketWriter:
+    # Buffers parsed tickets and writes them with DB.insert_tickets every batch_size rows or flush_seconds
+    def __init__(self, db, batch_size=100, flush_seconds=5.0, upsert=False):
+        self.db = db
+        self.upsert = upsert
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.outcomes = {'inserted': 0, 'duplicate': 0, 'updated': 0, 'error': 0}
+
+    # Returns the ticket id, None if the entry has no valid id (reported as error, not written)
+    def add(self, properties):
+        ticket_id = ticket_id_of(properties)
+        if ticket_id is None:
+            print(f"Error: entry without valid ticket id (guid {properties.get('guid')}), skipped")
+            self.outcomes['error'] += 1
+            return None
+
+        self.buffer.append(properties)
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_seconds:
+            self.flush()
+        return ticket_id
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return {}
+
+        batch, self.buffer = self.buffer, []
+        outcomes = self.db.insert_tickets(batch, self.upsert)
+        for outcome in outcomes.values():
+            self.outcomes[outcome] += 1
+        return outcomes
+
+    def close(self):
+        self.flush()
+        print(f"Tickets inserted: {self.outcomes['inserted']}, already existing: {self.outcomes['duplicate']}, updated: {self.outcomes['updated']}, failed: {self.outcomes['error']}")
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO)  
 
+    parser = argparse.ArgumentParser(description="Transfer tickets from the ticket api to the database.")
+    parser.add_argument("--concurrency", type=int, default=None, help="initial number of in-flight api requests (1 = serial)")
+    parser.add_argument("--page-size", type=int, default=None, help="read the id range from the OData feed with this many entries per request")
+    parser.add_argument("--start-id", type=int, default=None, help="highest ticket id to harvest")
+    parser.add_argument("--steps", type=int, default=None, help="number of ticket ids to harvest, counting down from the start id")
+    parser.add_argument("--delta", action="store_true", help="upsert the tickets changed since the last delta sync instead of harvesting new ids")
+    parser.add_argument("--recheck", action="store_true", help="re-read the harvested tickets of the id range with conditional requests and upsert the changed ones")
+    parser.add_argument("--reparse", action="store_true", help="rebuild the tickets table from the response cache without api calls")
+    parser.add_argument("--since", default=None, help="start time of the delta sync (YYYY-MM-DDTHH:MM:SS, UTC), defaults to the last delta sync")
+    args = parser.parse_args()
+
     # Read configuration file
     with open('config.json', 'r') as file:
         config = json.load(file)
 
-    ticket_id = 11851846 # 01.06.2024
-    steps = 1
+    ticket_id = args.start_id or config.get('harvest-start-id', 11851846) # 01.06.2024
+    steps = args.steps or config.get('harvest-steps', 1)
+    block_size = config.get('harvest-block-size', 1000)
+
+    concurrency = args.concurrency or config.get('harvest-concurrency', 1)
+
+    cache = None
+    if config.get('response-cache-dir'):
+        cache = ResponseCache(config['response-cache-dir'])
+        print(f"Cached responses: {len(cache)}")
 
     #create connection
-    api = Api(config)
+    api = Api(config, cache, config.get('harvest-max-concurrency', 32))
     db = DB(config)
+    writer = TicketWriter(db, config.get('db-batch-size', 100), config.get('db-flush-seconds', 5.0), upsert=args.delta or args.reparse or args.recheck)
+
+    if concurrency > 1:
+        controller = AdaptiveConcurrency(
+            initial=concurrency,
+            maximum=config.get('harvest-max-concurrency', 32),
+            latency_target=config.get('harvest-latency-target', 1.0)
+        )
+        harvester = ConcurrentHarvester(api, controller)
+        reporter = harvester.reporter
+    else:
+        reporter = ThroughputReporter()
 
-    for i in range(steps):
-        # check db
-        ticket_exists = db.check_ticket_exists_in_db(ticket_id)
+    gap_threshold = config.get('harvest-gap-threshold', 20)
 
-        if not ticket_exists:
-            print(f"Process: {ticket_id}")
-            #read
+    # $count of an id window, used to skip empty windows
+    def count_range(range_start, range_end):
+        try:
+            return api.count_range(range_start, range_end)
+        except Exception as e:
+            print(f"Error: {e}")
+            return None
+
+    # Harvests one block, returns the number of tickets that could not be harvested
+    def harvest_block(block_start, block_end, harvested_ids, empty_ids):
+        failures = 0
+
+        if args.page_size:
             try:
-                parsed_data = api.read(ticket_id)
-                #print(parsed_data)
-                db.insert_ticket(parsed_data['properties'])
+                for parsed_data in api.read_range(block_start, block_end, args.page_size):
+                    entry_id = ticket_id_of(parsed_data['properties'])
+                    if entry_id is not None and entry_id in harvested_ids:
+                        continue
+                    writer.add(parsed_data['properties'])
             except Exception as e:
                 print(f"Error: {e}")
-            time.sleep(0.5)
+                failures += 1
+        elif concurrency > 1:
+            def store_ticket(candidate_id, parsed_data):
+                writer.add(parsed_data['properties'])
+
+            # The prober yields the ids to read and skips the empty windows below runs of 404s
+            prober = GapProber(None, count_range if api.feed_path else None, reporter, gap_threshold)
+            failures += harvester.run(prober.iter_ids(block_start, block_end, harvested_ids, empty_ids), store_ticket, prober.on_missing)
+            db.insert_empty_ranges(prober.finish())
+            failures += prober.failures
         else:
-            print("Skipping ...")
+            def read_ticket(candidate_id):
+                print(f"Process: {candidate_id}")
+                try:
+                    parsed_data = api.read(candidate_id)
+                    writer.add(parsed_data['properties'])
+                    return True
+                except ApiError as e:
+                    print(f"Error: {e}")
+                    return False if e.status_code == 404 else None
+                except Exception as e:
+                    print(f"Error: {e}")
+                    return None
+                finally:
+                    time.sleep(0.5)
+
+            prober = GapProber(read_ticket, count_range if api.feed_path else None, reporter, gap_threshold)
+            db.insert_empty_ranges(prober.run(block_start, block_end, harvested_ids, empty_ids))
+            failures += prober.failures
+
+        # A block only counts as completed once all of its tickets are committed
+        errors_before = writer.outcomes['error']
+        writer.flush()
+        return failures + writer.outcomes['error'] - errors_before
+
+    # Delta sync: upsert changed tickets and mark their downstream rows stale
+    def delta_sync():
+        since = args.since or db.read_state('last_delta_sync')
+        if since is None:
+            print("No previous delta sync found, pass --since YYYY-MM-DDTHH:MM:SS")
+            return
+
+        # Changes made while this sync runs are picked up by the next one
+        sync_started = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+        print(f"Delta sync of tickets updated since {since}")
+
+        changed_ids = []
+        errors_before = writer.outcomes['error']
+        try:
+            for parsed_data in api.read_updated_since(datetime.fromisoformat(since), args.page_size or 100):
+                changed_id = writer.add(parsed_data['properties'])
+                if changed_id is not None:
+                    changed_ids.append(changed_id)
+        except Exception as e:
+            print(f"Error: {e}")
+            return
+        writer.flush()
+
+        print(f"Changed tickets: {len(changed_ids)}")
+        if writer.outcomes['error'] != errors_before:
+            print("Delta sync incomplete, it will be repeated on the next run")
+            return
+
+        batch_size = config.get('db-batch-size', 100)
+        for offset in range(0, len(changed_ids), batch_size):
+            if not db.mark_stages_stale(changed_ids[offset:offset + batch_size]):
+                print("Delta sync incomplete, it will be repeated on the next run")
+                return
+        db.update_state('last_delta_sync', sync_started)
+
+    # Rebuild the tickets table from the cached responses, e.g. after a parser change
+    def reparse():
+        if cache is None:
+            print("No response cache configured (response-cache-dir).")
+            return
+
+        for cached_id, content in cache.iter_responses():
+            try:
+                writer.add(parse_entry_document(content)['properties'])
+            except Exception as e:
+                print(f"Error: {cached_id}: {e}")
+
+    # Conditional re-read of harvested tickets, unchanged tickets (304 or the cached body) cost neither parsing nor db writes
+    def recheck():
+        if cache is None:
+            print("No response cache configured (response-cache-dir), it holds the ETag/Last-Modified of the tickets.")
+            return
+
+        controller = AdaptiveConcurrency(
+            initial=concurrency,
+            maximum=config.get('harvest-max-concurrency', 32),
+            latency_target=config.get('harvest-latency-target', 1.0)
+        )
+        rechecker = ConcurrentHarvester(api, controller, read=lambda candidate_id: api.read(candidate_id, revalidate=True))
+        changed_ids = []
+
+        def store_changed_ticket(candidate_id, parsed_data):
+            if parsed_data is None:
+                return
+            changed_id = writer.add(parsed_data['properties'])
+            if changed_id is not None:
+                changed_ids.append(changed_id)
+
+        for block_start, block_end in iter_blocks(ticket_id, ticket_id - steps + 1, block_size):
+            harvested_ids = db.read_ticket_ids(block_end, block_start)
+            print(f"Recheck range: {block_start} - {block_end} ({len(harvested_ids)} tickets)")
+            rechecker.run((candidate_id for candidate_id in range(block_start, block_end - 1, -1) if candidate_id in harvested_ids), store_changed_ticket)
+
+            writer.flush()
+            db.mark_stages_stale(changed_ids)
+            print(f"Changed tickets: {len(changed_ids)}")
+            changed_ids.clear()
+
+    if args.reparse:
+        reparse()
+    elif args.recheck:
+        recheck()
+    elif args.delta:
+        delta_sync()
+    else:
+        completed_ranges = db.read_harvested_ranges()
+
+        for block_start, block_end in iter_blocks(ticket_id, ticket_id - steps + 1, block_size):
+            if completed_ranges.covers(block_start, block_end):
+                print(f"Skipping completed range: {block_start} - {block_end}")
+                continue
+
+            print(f"Process range: {block_start} - {block_end}")
+            harvested_ids = db.read_ticket_ids(block_end, block_start)
+            empty_ids = db.read_empty_ids(block_end, block_start)
+            print(f"Already harvested in range: {len(harvested_ids)}, known empty: {len(empty_ids)}")
+
+            if harvest_block(block_start, block_end, harvested_ids, empty_ids) == 0:
+                db.insert_harvested_range(block_start, block_end)
+                completed_ranges.add(block_start, block_end)
+            else:
+                print(f"Range {block_start} - {block_end} incomplete, it will be retried on the next run")
+
+        if not args.page_size and concurrency <= 1:
+            reporter.report()
 
-        ticket_id = ticket_id - 1
+    writer.close()
@@ -0,0 +1,396 @@
+import time
+import heapq
+import random
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Status codes that mean "the ticket system is overloaded, back off"
+THROTTLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class AdaptiveConcurrency:
+    # AIMD controller for the number of in-flight API requests:
+    # +1 after a full window of healthy responses, halve on throttling or slow responses
+    def __init__(self, initial=4, minimum=1, maximum=32, latency_target=1.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.latency_target = latency_target
+        self.successes = 0
+        self.last_decrease = 0.0
+
+    def on_success(self, latency):
+        if latency > 2 * self.latency_target:
+            self._decrease()
+            return
+
+        self.successes += 1
+        if self.successes >= self.limit and latency <= self.latency_target:
+            self.successes = 0
+            if self.limit < self.maximum:
+                self.limit += 1
+
+    def on_throttle(self):
+        self._decrease()
+
+    def _decrease(self):
+        # Only decrease once per latency window, in-flight requests report the same congestion
+        now = time.monotonic()
+        if now - self.last_decrease < self.latency_target:
+            return
+        self.last_decrease = now
+        self.successes = 0
+        self.limit = max(self.minimum, self.limit // 2)
+
+# Seconds to wait from the Retry-After header of a response (delay seconds or http date), None if missing
+def retry_after_seconds(headers):
+    value = headers.get('Retry-After') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class ThroughputReporter:
+    def __init__(self, report_every=100):
+        self.report_every = report_every
+        self.started = time.monotonic()
+        self.processed = 0
+        self.requests = 0
+        self.not_found = 0
+
+    # Every api request, not_found for ids that do not exist (wasted requests)
+    def count_request(self, not_found=False):
+        self.requests += 1
+        if not_found:
+            self.not_found += 1
+
+    def tick(self, controller=None):
+        self.processed += 1
+        if self.processed % self.report_every == 0:
+            self.report(controller)
+
+    def report(self, controller=None):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        rate = self.processed / elapsed
+        limit = f" (in-flight limit: {controller.limit})" if controller else ""
+        print(f"Harvested {self.processed} tickets in {elapsed:.1f}s: {rate:.2f} tickets/s{limit}")
+        if self.requests:
+            print(f"Wasted requests (not found): {self.not_found}/{self.requests} ({100 * self.not_found / self.requests:.1f}%)")
+
+class ConcurrentHarvester:
+    def __init__(self, api, controller, max_retries=5, report_every=100, read=None, backoff=1.0, max_backoff=60.0):
+        self.api = api
+        self.read = read or api.read
+        self.controller = controller
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.reporter = ThroughputReporter(report_every)
+
+    def _timed_read(self, ticket_id):
+        started = time.monotonic()
+        try:
+            return self.read(ticket_id), None, time.monotonic() - started
+        except Exception as e:
+            return None, e, time.monotonic() - started
+
+    # Delay before the nth retry of a throttled id: exponential with jitter, at least the Retry-After of the response
+    def _retry_delay(self, retry, retry_after):
+        delay = min(self.max_backoff, self.backoff * 2 ** (retry - 1)) * random.uniform(1.0, 1.5)
+        return max(delay, retry_after or 0.0)
+
+    # Reads all ticket ids with up to controller.limit requests in flight.
+    # on_ticket and on_missing (ids that do not exist) are called in the calling thread, so they may use
+    # the (not thread safe) DB connection. Throttled ids are retried after a backoff, a Retry-After also
+    # pauses new requests. Returns the number of ids that failed for other reasons than "not found".
+    def run(self, ticket_ids, on_ticket, on_missing=None):
+        failures = 0
+        pending = iter(ticket_ids)
+        # (time the retry is due, ticket_id)
+        retry_heap = []
+        retries = {}
+        in_flight = {}
+        exhausted = False
+        paused_until = 0.0
+
+        # Earliest time a request can be sent again, None if there is nothing left to send
+        def next_send():
+            times = []
+            if retry_heap:
+                times.append(max(retry_heap[0][0], paused_until))
+            if not exhausted:
+                times.append(paused_until)
+            return min(times) if times else None
+
+        with ThreadPoolExecutor(max_workers=self.controller.maximum) as executor:
+            while True:
+                now = time.monotonic()
+                while len(in_flight) < self.controller.limit and now >= paused_until:
+                    if retry_heap and retry_heap[0][0] <= now:
+                        _, ticket_id = heapq.heappop(retry_heap)
+                    elif not exhausted:
+                        ticket_id = next(pending, None)
+                        if ticket_id is None:
+                            exhausted = True
+                            continue
+                    else:
+                        break
+                    in_flight[executor.submit(self._timed_read, ticket_id)] = ticket_id
+
+                send_at = next_send()
+                if not in_flight:
+                    if send_at is None:
+                        break
+                    # Only retries or a pause are left
+                    time.sleep(max(0.0, send_at - time.monotonic()))
+                    continue
+
+                timeout = None
+                if send_at is not None and len(in_flight) < self.controller.limit:
+                    timeout = max(0.0, send_at - time.monotonic())
+                done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    ticket_id = in_flight.pop(future)
+                    parsed_data, error, latency = future.result()
+                    self.reporter.count_request(getattr(error, 'status_code', None) == 404)
+
+                    if error is None:
+                        self.controller.on_success(latency)
+                        on_ticket(ticket_id, parsed_data)
+                        self.reporter.tick(self.controller)
+                    elif getattr(error, 'status_code', None) in THROTTLE_STATUS_CODES:
+                        self.controller.on_throttle()
+                        retries[ticket_id] = retries.get(ticket_id, 0) + 1
+                        if retries[ticket_id] <= self.max_retries:
+                            retry_after = retry_after_seconds(getattr(error, 'headers', None))
+                            if retry_after is not None:
+                                paused_until = max(paused_until, time.monotonic() + retry_after)
+                            delay = self._retry_delay(retries[ticket_id], retry_after)
+                            heapq.heappush(retry_heap, (time.monotonic() + delay, ticket_id))
+                            print(f"Throttled on {ticket_id}, retry in {delay:.1f}s, in-flight limit now {self.controller.limit}")
+                        else:
+                            print(f"Error: giving up on {ticket_id} after {self.max_retries} retries: {error}")
+                            failures += 1
+                    else:
+                        self.controller.on_success(latency)
+                        print(f"Error: {ticket_id}: {error}")
+                        if getattr(error, 'status_code', None) != 404:
+                            failures += 1
+                        elif on_missing is not None:
+                            on_missing(ticket_id)
+
+        self.reporter.report(self.controller)
+        return failures
+
+class TicketIdSet:
+    # Bitmap over the id span [low, high], one bit per ticket id
+    def __init__(self, low, high):
+        self.low = min(low, high)
+        self.high = max(low, high)
+        self.bits = bytearray((self.high - self.low) // 8 + 1)
+        self.count = 0
+
+    def add(self, ticket_id):
+        offset = ticket_id - self.low
+        if 0 <= offset <= self.high - self.low:
+            mask = 1 << (offset & 7)
+            if not self.bits[offset >> 3] & mask:
+                self.bits[offset >> 3] |= mask
+                self.count += 1
+
+    def __contains__(self, ticket_id):
+        offset = ticket_id - self.low
+        if offset < 0 or offset > self.high - self.low:
+            return False
+        return bool(self.bits[offset >> 3] & (1 << (offset & 7)))
+
+    def __len__(self):
+        return self.count
+
+class CompletedRanges:
+    # Sorted, merged list of [low, high] id ranges that are completely harvested
+    def __init__(self, ranges=()):
+        self.ranges = []
+        for low, high in ranges:
+            self.add(low, high)
+
+    def add(self, low, high):
+        low, high = min(low, high), max(low, high)
+        merged = []
+        for range_low, range_high in self.ranges:
+            if range_high < low - 1 or range_low > high + 1:
+                merged.append((range_low, range_high))
+            else:
+                low, high = min(low, range_low), max(high, range_high)
+        merged.append((low, high))
+        self.ranges = sorted(merged)
+
+    def covers(self, low, high):
+        low, high = min(low, high), max(low, high)
+        return any(range_low <= low and high <= range_high for range_low, range_high in self.ranges)
+
+# Splits start_id >= id >= end_id into blocks aligned to multiples of block_size, highest block first.
+# Aligned blocks line up with the recorded ranges even if a later run starts at a different id.
+def iter_blocks(start_id, end_id, block_size):
+    high = start_id
+    while high >= end_id:
+        low = max(end_id, (high // block_size) * block_size)
+        yield high, low
+        high = low - 1
+
+class GapProber:
+    # Harvesting that learns sparse regions of the id space: after gap_threshold consecutive misses
+    # it asks the api how many tickets exist in a window below the last miss. Empty windows are
+    # skipped and the window doubles (galloping), a non empty window is halved until single reads
+    # take over again. count_range(high, low) returns the number of tickets or None on errors.
+    # Serial mode: run() with read_ticket(id) returning True if the ticket exists, False if not found
+    # and None on other errors. Concurrent mode: iter_ids() feeds ConcurrentHarvester.run, which
+    # reports the ids that do not exist to on_missing.
+    def __init__(self, read_ticket, count_range, reporter, gap_threshold=20, max_window=4096):
+        self.read_ticket = read_ticket
+        self.count_range = count_range
+        self.reporter = reporter
+        self.gap_threshold = gap_threshold
+        self.max_window = max_window
+        self.failures = 0
+        self.missing = set()
+
+    def _probe(self, ticket_id):
+        found = self.read_ticket(ticket_id)
+        self.reporter.count_request(found is False)
+        if found:
+            self.reporter.tick()
+        elif found is None:
+            self.failures += 1
+        return found
+
+    def _count(self, high, low):
+        count = self.count_range(high, low)
+        self.reporter.count_request()
+        if count is None:
+            self.failures += 1
+        return count
+
+    # Skips the empty windows from ticket_id down, returns the next id that has to be read
+    def _gallop(self, ticket_id, low):
+        window = self.gap_threshold
+        while ticket_id >= low:
+            window_low = max(low, ticket_id - window + 1)
+            count = self._count(ticket_id, window_low)
+            if count is None:
+                break
+            if count == 0:
+                ticket_id = window_low - 1
+                window = min(window * 2, self.max_window)
+            elif window <= self.gap_threshold:
+                # A ticket is close, continue with single reads
+                break
+            else:
+                window //= 2
+        return ticket_id
+
+    # Harvests high >= id >= low, returns the empty ranges [(high, low)] that were found
+    def run(self, high, low, harvested_ids, empty_ids):
+        empty_ranges = []
+        ticket_id = high
+        miss_top = None
+        misses = 0
+
+        while ticket_id >= low:
+            if ticket_id in harvested_ids:
+                miss_top, misses = None, 0
+                ticket_id -= 1
+                continue
+            if ticket_id in empty_ids:
+                ticket_id -= 1
+                continue
+
+            found = self._probe(ticket_id)
+            if found is not False:
+                # Errors end a miss streak too, the id is not known to be empty
+                miss_top, misses = None, 0
+                ticket_id -= 1
+                continue
+
+            if miss_top is None:
+                miss_top = ticket_id
+            misses += 1
+            ticket_id -= 1
+            if misses < self.gap_threshold or self.count_range is None:
+                continue
+
+            # Sparse region: gallop over empty windows below the miss streak
+            ticket_id = self._gallop(ticket_id, low)
+            empty_ranges.append((miss_top, ticket_id + 1))
+            miss_top, misses = None, 0
+
+        if miss_top is not None:
+            empty_ranges.append((miss_top, low))
+        return empty_ranges
+
+    # Ids that do not exist, reported by ConcurrentHarvester.run. Once the run of misses around an id
+    # reaches gap_threshold, iter_ids gallops before it yields the next id. Misses above the last gallop
+    # were covered by its probes: they neither trigger another gallop nor count towards the next run,
+    # also when the gallop stopped right away ($count error or a ticket close below).
+    def on_missing(self, ticket_id):
+        self.missing.add(ticket_id)
+        if self.count_range is None or ticket_id > self.resume_id:
+            return
+        run_high = run_low = ticket_id
+        while run_high + 1 <= self.resume_id and run_high + 1 in self.missing:
+            run_high += 1
+        while run_low - 1 in self.missing:
+            run_low -= 1
+        if run_high - run_low + 1 >= self.gap_threshold:
+            self.gap_found = True
+
+    # Yields the ids of high >= id >= low that have to be read, for the concurrent harvester. Ids in flight
+    # are unknown, so a miss streak is detected a few ids late and the ids read meanwhile stay single reads.
+    # finish() returns the empty ranges after the harvester finished.
+    def iter_ids(self, high, low, harvested_ids, empty_ids):
+        self.missing = set()
+        self.galloped = []
+        self.low = low
+        self.resume_id = high
+        self.gap_found = False
+        ticket_id = high
+
+        while ticket_id >= low:
+            if ticket_id in harvested_ids or ticket_id in empty_ids:
+                ticket_id -= 1
+                continue
+
+            if self.gap_found:
+                # Sparse region: gallop over empty windows below the miss streak
+                self.gap_found = False
+                next_id = self._gallop(ticket_id, low)
+                if next_id < ticket_id:
+                    self.galloped.append((ticket_id, next_id + 1))
+                self.resume_id = ticket_id = next_id
+                continue
+
+            yield ticket_id
+            ticket_id -= 1
+
+    # Empty ranges [(high, low)] of the last iter_ids: the galloped windows with the misses next to them,
+    # runs of at least gap_threshold misses and the run of misses at the end of the range
+    def finish(self):
+        ranges = [(ticket_id, ticket_id) for ticket_id in self.missing]
+        ranges.extend(self.galloped)
+        ranges.sort(reverse=True)
+
+        merged = []
+        for high, low in ranges:
+            if merged and merged[-1][1] - 1 == high:
+                merged[-1][1] = low
+                merged[-1][2] = merged[-1][2] or (high, low) in self.galloped
+            else:
+                merged.append([high, low, (high, low) in self.galloped])
+
+        return [(high, low) for high, low, galloped in merged
+                if galloped or high - low + 1 >= self.gap_threshold or low == self.low]
@@ -0,0 +1,127 @@
+import threading
+from io import BytesIO
+from lxml import etree
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+DATASERVICES = '{http://schemas.microsoft.com/ado/2007/08/dataservices}'
+METADATA = '{http://schemas.microsoft.com/ado/2007/08/dataservices/metadata}'
+
+ATOM_ENTRY = ATOM + 'entry'
+ATOM_ID = ATOM + 'id'
+ATOM_TITLE = ATOM + 'title'
+ATOM_UPDATED = ATOM + 'updated'
+ATOM_CATEGORY = ATOM + 'category'
+ATOM_LINK = ATOM + 'link'
+ATOM_CONTENT = ATOM + 'content'
+METADATA_PROPERTIES = METADATA + 'properties'
+
+# Properties of a ticket entry, in the order of the tickets table
+PROPERTY_NAMES = (
+    'sap_ticketstatus', 'sap_ticketstatus_t', 'sap_ticketno', 'cdl_text', 'id', 'guid',
+    'processtype', 'action', 'company', 'reporter', 'supportteam', 'editor',
+    'status', 'statustxt', 'category', 'component', 'ibase', 'sysrole',
+    'priority', 'title', 'text', 'text2', 'security', 'postpuntil',
+    'linkid', 'cdlid', 'optid', 'psp', 'units', 'type'
+)
+
+# Fully qualified tag -> property name, so each m:properties child costs one dict lookup
+PROPERTY_TAGS = {DATASERVICES + name: name for name in PROPERTY_NAMES}
+
+# PROPERTY_TAGS plus further properties that are read but not stored, e.g. the timestamp of the delta sync
+def property_tags(extra_names=()):
+    tags = dict(PROPERTY_TAGS)
+    tags.update((DATASERVICES + name, name) for name in extra_names)
+    return tags
+
+# lxml parsers must not be shared between threads (the harvester reads concurrently)
+_local = threading.local()
+
+def _parser():
+    parser = getattr(_local, 'parser', None)
+    if parser is None:
+        parser = _local.parser = etree.XMLParser(recover=True)
+    return parser
+
+def _get_text(element):
+    return element.text.strip() if element is not None and element.text else None
+
+def _parse_properties(properties_element, properties, tags):
+    for prop in properties_element:
+        name = tags.get(prop.tag)
+        # First occurrence wins, like ElementTree.find
+        if name is not None and name not in properties:
+            properties[name] = _get_text(prop)
+
+# Walks the children of an atom:entry element once and builds the parsed ticket dict
+def parse_entry(entry, tags=PROPERTY_TAGS):
+    parsed_data = {
+        'id': None,
+        'title': None,
+        'updated': None,
+        'category': None,
+        'links': [],
+        'properties': None
+    }
+    properties = {}
+
+    for child in entry:
+        tag = child.tag
+        if tag == ATOM_CONTENT:
+            for content_child in child:
+                if content_child.tag == METADATA_PROPERTIES:
+                    _parse_properties(content_child, properties, tags)
+                    break
+        elif tag == ATOM_LINK:
+            parsed_data['links'].append({
+                'href': child.get('href'),
+                'rel': child.get('rel'),
+                'title': child.get('title'),
+                'type': child.get('type')
+            })
+        elif tag == ATOM_ID and parsed_data['id'] is None:
+            parsed_data['id'] = _get_text(child)
+        elif tag == ATOM_TITLE and parsed_data['title'] is None:
+            parsed_data['title'] = _get_text(child)
+        elif tag == ATOM_UPDATED and parsed_data['updated'] is None:
+            parsed_data['updated'] = _get_text(child)
+        elif tag == ATOM_CATEGORY and parsed_data['category'] is None:
+            parsed_data['category'] = {
+                'scheme': child.get('scheme'),
+                'term': child.get('term')
+            }
+
+    if parsed_data['category'] is None:
+        parsed_data['category'] = {'scheme': None, 'term': None}
+    parsed_data['properties'] = {name: properties.get(name) for name in tags.values()}
+    return parsed_data
+
+# Parses a single entry response (Api.read)
+def parse_entry_document(content):
+    root = etree.fromstring(content, parser=_parser())
+    return parse_entry(root)
+
+# Streams the entries of a feed response, clearing parsed elements so memory stays flat.
+# With raw=True (parsed_data, entry_xml, etag) tuples are yielded for the response cache.
+# The href of a <link rel="next"> of the feed (server side paging) is appended to next_links.
+# tags (property_tags) selects the properties of the entries.
+def iter_feed_entries(content, raw=False, next_links=None, tags=PROPERTY_TAGS):
+    source = BytesIO(content) if isinstance(content, (bytes, bytearray)) else content
+    for _, element in etree.iterparse(source, events=('end',), tag=(ATOM_ENTRY, ATOM_LINK), recover=True):
+        if element.tag == ATOM_LINK:
+            # Links of an entry end before the entry, only links of the feed itself have no entry parent
+            parent = element.getparent()
+            if next_links is not None and element.get('rel') == 'next' and (parent is None or parent.tag != ATOM_ENTRY):
+                next_links.append(element.get('href'))
+            continue
+
+        entry = element
+        if raw:
+            yield parse_entry(entry, tags), etree.tostring(entry), entry.get(METADATA + 'etag')
+        else:
+            yield parse_entry(entry, tags)
+
+        entry.clear(keep_tail=True)
+        parent = entry.getparent()
+        if parent is not None:
+            while entry.getprevious() is not None:
+                del parent[0]
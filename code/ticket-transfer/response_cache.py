@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import threading
+import zlib
+
+class ResponseCache:
+    # Raw api responses, zlib compressed and appended to segment files.
+    # index.jsonl maps every ticket id to the location of its latest response (the last line wins),
+    # identical responses are stored once and shared by content hash.
+    def __init__(self, directory, segment_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.index_path = os.path.join(directory, 'index.jsonl')
+        self.entries = {}
+        self.locations = {}
+        self.lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.__load_index()
+        self.segment = max((entry['segment'] for entry in self.entries.values()), default=0)
+
+    def __load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r') as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn last line of an interrupted run
+                    continue
+                self.entries[entry['id']] = entry
+                self.locations[entry['sha256']] = (entry['segment'], entry['offset'], entry['length'])
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:05d}.bin")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, ticket_id):
+        return int(ticket_id) in self.entries
+
+    def meta(self, ticket_id):
+        return self.entries.get(int(ticket_id))
+
+    def get(self, ticket_id):
+        entry = self.entries.get(int(ticket_id))
+        if entry is None:
+            return None
+        with open(self._segment_path(entry['segment']), 'rb') as file:
+            file.seek(entry['offset'])
+            return zlib.decompress(file.read(entry['length']))
+
+    def put(self, ticket_id, content, etag=None, last_modified=None, updated=None):
+        ticket_id = int(ticket_id)
+        sha256 = hashlib.sha256(content).hexdigest()
+
+        with self.lock:
+            previous = self.entries.get(ticket_id)
+            if previous and previous['sha256'] == sha256 and previous.get('etag') == etag \
+                    and previous.get('last_modified') == last_modified and previous.get('updated') == updated:
+                return
+
+            location = self.locations.get(sha256)
+            if location is None:
+                location = self.__append(zlib.compress(content))
+                self.locations[sha256] = location
+
+            segment, offset, length = location
+            entry = {
+                'id': ticket_id,
+                'sha256': sha256,
+                'etag': etag,
+                'last_modified': last_modified,
+                'updated': updated,
+                'segment': segment,
+                'offset': offset,
+                'length': length
+            }
+            with open(self.index_path, 'a') as file:
+                file.write(json.dumps(entry) + '\n')
+            self.entries[ticket_id] = entry
+
+    def __append(self, data):
+        path = self._segment_path(self.segment)
+        if os.path.exists(path) and os.path.getsize(path) + len(data) > self.segment_size:
+            self.segment += 1
+            path = self._segment_path(self.segment)
+
+        with open(path, 'ab') as file:
+            offset = file.tell()
+            file.write(data)
+        return self.segment, offset, len(data)
+
+    # Yields (ticket_id, content) for all cached tickets, ordered by segment and offset for sequential reads
+    def iter_responses(self):
+        entries = sorted(self.entries.values(), key=lambda entry: (entry['segment'], entry['offset']))
+        file = None
+        segment = None
+        try:
+            for entry in entries:
+                if entry['segment'] != segment:
+                    if file:
+                        file.close()
+                    segment = entry['segment']
+                    file = open(self._segment_path(segment), 'rb')
+                file.seek(entry['offset'])
+                yield entry['id'], zlib.decompress(file.read(entry['length']))
+        finally:
+            if file:
+                file.close()
@@ -45,7 +45,28 @@ DROP TABLE IF EXISTS `tickets_texts`;
 CREATE TABLE `tickets_texts` (
   `id` INT NOT NULL AUTO_INCREMENT,
   `text` MEDIUMTEXT DEFAULT NULL,
-  PRIMARY KEY (`id`)
+  `raw_hash` CHAR(64) DEFAULT NULL,
+  `config_version` CHAR(64) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `idx_config_version` (`config_version`)
+) ENGINE=InnoDB;
+
+-- Create the `tickets_texts_entries` table (keywords and specific terms that occur in the tickets cleaned by cleanup-tickets.py)
+DROP TABLE IF EXISTS `tickets_texts_entries`;
+CREATE TABLE `tickets_texts_entries` (
+  `entry` VARCHAR(255) COLLATE utf8mb4_bin NOT NULL,
+  `id` INT NOT NULL,
+  PRIMARY KEY (`entry`, `id`),
+  KEY `idx_id` (`id`)
+) ENGINE=InnoDB;
+
+-- Create the `cleanup_configs` table (keywords and specific terms of every config version of cleanup-tickets.py)
+DROP TABLE IF EXISTS `cleanup_configs`;
+CREATE TABLE `cleanup_configs` (
+  `version` CHAR(64) NOT NULL,
+  `config` MEDIUMTEXT NOT NULL,
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`version`)
 ) ENGINE=InnoDB;
 
 -- Create the `tickets_summary` table
@@ -64,3 +85,61 @@ CREATE TABLE `tickets_texts_cleaned` (
   `text` MEDIUMTEXT DEFAULT NULL,
   PRIMARY KEY (`id`)
 ) ENGINE=InnoDB;
+
+-- Create the `harvest_ranges` table (completed and known empty id ranges of get-tickets.py)
+DROP TABLE IF EXISTS `harvest_ranges`;
+CREATE TABLE `harvest_ranges` (
+  `start_id` INT NOT NULL,
+  `end_id` INT NOT NULL,
+  `kind` VARCHAR(10) NOT NULL DEFAULT 'harvested',
+  `completed_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`start_id`, `end_id`, `kind`)
+) ENGINE=InnoDB;
+
+-- Create the `pipeline_state` table (values the scripts keep between runs: time of the last delta sync of get-tickets.py, filter version of clean-pii.py)
+DROP TABLE IF EXISTS `pipeline_state`;
+CREATE TABLE `pipeline_state` (
+  `name` VARCHAR(50) NOT NULL,
+  `value` VARCHAR(255) DEFAULT NULL,
+  `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB;
+
+-- Create the `tickets_stale` table (rows of the stage tables that have to be rebuilt because the ticket changed)
+DROP TABLE IF EXISTS `tickets_stale`;
+CREATE TABLE `tickets_stale` (
+  `id` INT NOT NULL,
+  `stage` VARCHAR(50) NOT NULL,
+  `marked_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`, `stage`)
+) ENGINE=InnoDB;
+
+-- Create the `tickets_flagged` table (tickets a stage skips, e.g. pathological texts over the time budget of cleanup-tickets.py)
+DROP TABLE IF EXISTS `tickets_flagged`;
+CREATE TABLE `tickets_flagged` (
+  `id` INT NOT NULL,
+  `stage` VARCHAR(50) NOT NULL,
+  `reason` VARCHAR(255) DEFAULT NULL,
+  `flagged_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`id`, `stage`)
+) ENGINE=InnoDB;
+
+-- Create the `pii_names` table (person names clean-pii.py found, valid or discarded, with the number of tickets)
+DROP TABLE IF EXISTS `pii_names`;
+CREATE TABLE `pii_names` (
+  `name` VARCHAR(255) COLLATE utf8mb4_bin NOT NULL,
+  `kind` VARCHAR(20) NOT NULL,
+  `tickets` INT NOT NULL DEFAULT 0,
+  `first_seen` DATETIME DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`name`, `kind`)
+) ENGINE=InnoDB;
+
+-- Create the `pii_entities` table (person entities the NER of clean-pii.py found, by hash of the ticket text and model version)
+DROP TABLE IF EXISTS `pii_entities`;
+CREATE TABLE `pii_entities` (
+  `text_hash` CHAR(64) NOT NULL,
+  `model` VARCHAR(100) NOT NULL,
+  `entities` MEDIUMTEXT NOT NULL,
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`text_hash`, `model`)
+) ENGINE=InnoDB;